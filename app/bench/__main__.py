@@ -0,0 +1,3 @@
+from bench.benchmark import main
+
+main()
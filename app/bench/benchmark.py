@@ -0,0 +1,301 @@
+"""
+Load test and benchmark for the API and the outbox pipeline.
+
+Seeds a file-backed database, drives concurrent create, update, get and
+search requests against create_app in process, then times the worker
+draining the outbox into a fake Galaxy, or a real one when a DSN is given.
+Results are written as JSON so runs can be compared across commits:
+
+    PYTHONPATH=app python -m bench --pulsars 1000 --users 5000 --requests 5000
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from sqlalchemy import select, insert, func
+from internal.config import AppConfig, WorkerConfig
+from models.model import User, Pulsar, Outbox, Message, pulsar_user
+from worker.worker import Worker
+from main import create_app
+
+# Share of each operation in the generated traffic
+DEFAULT_MIX = {"create": 0.1, "update": 0.1, "get": 0.5, "search": 0.3}
+
+class FakeGalaxy:
+    """Galaxy stand-in that accepts every change after a fixed delay per batch."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.batches = 0
+        self.changes = 0
+
+    def sync_batch(self, changes):
+        time.sleep(self.latency)
+        self.batches += 1
+        self.changes += len(changes)
+        return []
+
+def percentile(samples, q):
+    # Nearest-rank percentile of a sorted list
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+def summarize(latencies, errors, duration):
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rps": len(samples) / duration if duration > 0 else None,
+        "mean": sum(samples) / len(samples) if samples else None,
+        "p50": percentile(samples, 0.50),
+        "p99": percentile(samples, 0.99),
+        "max": samples[-1] if samples else None,
+    }
+
+def seed(session, pulsars, users, users_per_pulsar, rng):
+    """Insert users and pulsars with Core bulk inserts, and their outbox rows as an import would."""
+    session.execute(insert(User), [{"email": f"user{i}@bench.test"} for i in range(1, users + 1)])
+    session.execute(insert(Pulsar), [
+        {"url": f"https://pulsar{i}.bench.test", "api_key": f"key{i}"} for i in range(1, pulsars + 1)])
+    memberships = [
+        {"pulsar_id": pulsar_id, "user_id": user_id}
+        for pulsar_id in range(1, pulsars + 1)
+        for user_id in rng.sample(range(1, users + 1), min(users_per_pulsar, users))
+    ]
+    session.execute(insert(pulsar_user), memberships)
+    session.execute(insert(Outbox), [
+        {"message": Message.CREATED, "pulsar_id": row["pulsar_id"], "user_id": row["user_id"]}
+        for row in memberships])
+    session.commit()
+    return len(memberships)
+
+class Traffic:
+    def __init__(self, pulsars, users, users_per_pulsar, mix, rng):
+        self.pulsar_ids = list(range(1, pulsars + 1))
+        self.users = users
+        self.users_per_pulsar = users_per_pulsar
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.rng = rng
+
+    def _email(self):
+        return f"user{self.rng.randint(1, self.users)}@bench.test"
+
+    def _body(self):
+        return {
+            "url": f"https://pulsar{self.rng.randrange(10**9)}.bench.test",
+            "api_key": f"key{self.rng.randrange(10**9)}",
+            "users": [self._email() for _ in range(self.users_per_pulsar)],
+        }
+
+    def next(self):
+        # Returns (operation, method, path, json body or None)
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        if operation == "create":
+            return operation, "POST", "/api/pulsar", self._body()
+        if operation == "update":
+            return operation, "PUT", f"/api/pulsar/{self.rng.choice(self.pulsar_ids)}", self._body()
+        if operation == "get":
+            return operation, "GET", f"/api/pulsar/{self.rng.choice(self.pulsar_ids)}", None
+        return operation, "GET", f"/api/pulsar?user={self._email()}", None
+
+def _headers(config):
+    # Any configured key, the registry may not use the sample's
+    api_key = next(iter(config.auth.api_keys.values()), None)
+    return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+async def drive(app, traffic, requests, concurrency, headers):
+    """Send requests from concurrency clients, returning latencies, errors per operation and error statuses."""
+    latencies = {operation: [] for operation in traffic.operations}
+    errors = {operation: 0 for operation in traffic.operations}
+    statuses = {}
+    remaining = iter(range(requests))
+
+    async def client_loop(client):
+        for _ in remaining:
+            operation, method, path, body = traffic.next()
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body, headers=headers)
+            latencies[operation].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors[operation] += 1
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            elif operation == "create":
+                traffic.pulsar_ids.append(response.json()["id"])
+
+    # Unhandled exceptions become 500s and count as errors instead of stopping the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+    return latencies, errors, statuses, duration
+
+def _pending(app):
+    with app.state.db.get_session() as session:
+        return session.execute(select(func.count()).where(Outbox.deleted_at == None)).scalar()
+
+def drain(app, galaxy, worker_config):
+    """Time one worker draining the whole outbox."""
+    pending = _pending(app)
+    worker = Worker(app, galaxy, worker_config)
+    start = time.perf_counter()
+    worker._drain()
+    duration = time.perf_counter() - start
+    worker.executor.shutdown(wait=True)
+    left = _pending(app)
+    return {
+        "pending": pending,
+        "drained": pending - left,
+        "duration": duration,
+        "rows_per_second": (pending - left) / duration if duration > 0 else None,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(pulsars=1000, users=5000, users_per_pulsar=3, requests=5000, concurrency=32,
+                  mix=None, database_url=None, database_path=None, galaxy=None, worker_config=None,
+                  seed_value=0, config=None):
+    """
+    Run the whole benchmark and return its results as a dict. Without a
+    database URL or path, it runs on a temporary SQLite file.
+    """
+    rng = random.Random(seed_value)
+    mix = mix or DEFAULT_MIX
+    config = config or AppConfig()
+    # Admission control would turn the load into 429s and 503s
+    config.admission.rate_limit = 0
+    config.admission.outbox_backlog_limit = 0
+    config.database.in_memory = False
+    config.database.debug = False
+    config.database.url = database_url
+    with contextlib.ExitStack() as stack:
+        if database_url is None and database_path is None:
+            # The worker threads need a database on disk, not an in-memory one
+            database_path = os.path.join(stack.enter_context(tempfile.TemporaryDirectory()), "bench.db")
+        config.database.path = database_path
+        app = create_app(config)
+
+        start = time.perf_counter()
+        with app.state.db.get_session() as session:
+            memberships = seed(session, pulsars, users, users_per_pulsar, rng)
+        seed_duration = time.perf_counter() - start
+
+        traffic = Traffic(pulsars, users, users_per_pulsar, mix, rng)
+        latencies, errors, statuses, duration = asyncio.run(
+            drive(app, traffic, requests, concurrency, _headers(config)))
+        all_latencies = [latency for samples in latencies.values() for latency in samples]
+
+        galaxy = galaxy or FakeGalaxy()
+        outbox = drain(app, galaxy, worker_config or WorkerConfig())
+        app.state.db.engine.dispose()
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "backend": app.state.db.engine.dialect.name,
+        "parameters": {
+            "pulsars": pulsars,
+            "users": users,
+            "users_per_pulsar": users_per_pulsar,
+            "requests": requests,
+            "concurrency": concurrency,
+            "mix": mix,
+            "seed": seed_value,
+        },
+        "seed": {"memberships": memberships, "duration": seed_duration},
+        "http": {
+            "total": summarize(all_latencies, sum(errors.values()), duration),
+            "error_statuses": statuses,
+            "operations": {
+                operation: summarize(samples, errors[operation], duration)
+                for operation, samples in latencies.items()
+            },
+        },
+        "outbox": outbox,
+    }
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        operation, weight = part.split("=")
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation}")
+        mix[operation] = float(weight)
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pulsars", type=int, default=1000, help="pulsars seeded before the run")
+    parser.add_argument("--users", type=int, default=5000, help="users seeded before the run")
+    parser.add_argument("--users-per-pulsar", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=5000, help="HTTP requests sent in total")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent HTTP clients")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help="operation weights, e.g. create=0.1,update=0.1,get=0.5,search=0.3")
+    parser.add_argument("--database-url", default=None,
+                        help="SQLAlchemy URL of an empty database, a temporary SQLite file by default")
+    parser.add_argument("--galaxy-dsn", default=None, help="drain into this Galaxy database instead of a fake")
+    parser.add_argument("--galaxy-latency", type=float, default=0.0,
+                        help="seconds the fake Galaxy spends per batch")
+    parser.add_argument("--worker-batch-size", type=int, default=500)
+    parser.add_argument("--worker-concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0, help="random seed, runs with the same seed send the same traffic")
+    parser.add_argument("--output", default="bench_output.txt", help="file the JSON results are written to")
+    parser.add_argument("--config", default=None, help="configuration file, config.ini in the working directory by default")
+    args = parser.parse_args(argv)
+
+    worker_config = WorkerConfig(batch_size=args.worker_batch_size, concurrency=args.worker_concurrency)
+    if args.galaxy_dsn:
+        from galaxy.galaxy import Galaxy
+        config = AppConfig(path=args.config)
+        config.galaxy_database = args.galaxy_dsn
+        config.worker = worker_config
+        galaxy = Galaxy(config)
+    else:
+        galaxy = FakeGalaxy(args.galaxy_latency)
+
+    results = run_benchmark(
+        pulsars=args.pulsars,
+        users=args.users,
+        users_per_pulsar=args.users_per_pulsar,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        mix=args.mix,
+        database_url=args.database_url,
+        galaxy=galaxy,
+        worker_config=worker_config,
+        seed_value=args.seed,
+        config=AppConfig(path=args.config),
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+
+    total = results["http"]["total"]
+    print(
+        f"{total['requests']} requests, {total['rps']:.0f} req/s, "
+        f"p50 {total['p50'] * 1000:.1f} ms, p99 {total['p99'] * 1000:.1f} ms, "
+        f"outbox {results['outbox']['drained']} rows in {results['outbox']['duration']:.2f} s",
+        file=sys.stderr,
+    )
+    if total["errors"]:
+        # Latencies of refused requests would be misleading
+        sys.exit(f"{total['errors']} requests failed: {results['http']['error_statuses']}")
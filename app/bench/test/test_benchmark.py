@@ -0,0 +1,36 @@
+import os
+from internal.config import AppConfig
+from bench.benchmark import run_benchmark, percentile, FakeGalaxy
+
+SAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), "..", "..", "..", "config.ini.sample")
+
+def test_percentile_is_nearest_rank():
+    samples = list(range(1, 101))
+    assert percentile(samples, 0.50) == 50
+    assert percentile(samples, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+def test_run_benchmark(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    galaxy = FakeGalaxy()
+    config = AppConfig(path=SAMPLE_CONFIG)
+    config.auth.api_keys = {"default": "ANOTHER_KEY"}
+    config.admission.rate_limit = 0.001
+    results = run_benchmark(
+        # A single client makes the run deterministic
+        pulsars=20, users=50, requests=100, concurrency=1,
+        galaxy=galaxy, config=config)
+
+    total = results["http"]["total"]
+    assert total["requests"] == 100
+    # The configured key is used and admission limits are lifted
+    assert total["errors"] == 0
+    assert results["http"]["error_statuses"] == {}
+    assert total["p50"] <= total["p99"]
+    assert set(results["http"]["operations"]) == {"create", "update", "get", "search"}
+    assert results["backend"] == "sqlite"
+    # Every seeded and written outbox row reached the fake Galaxy
+    assert results["outbox"]["drained"] == results["outbox"]["pending"]
+    assert galaxy.changes > 0
+    # The default database is a temporary file, removed after the run
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, MetaData
+from main import create_app
+from internal.config import AppConfig
+
+@pytest.fixture(autouse=True)
+def reset_test_database():
+    # The in-memory database starts empty, an external one must be wiped
+    url = os.environ.get("PULSAR_REGISTRY_TEST_DATABASE_URL")
+    if url:
+        engine = create_engine(url)
+        metadata = MetaData()
+        metadata.reflect(engine)
+        metadata.drop_all(engine)
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as connection:
+                connection.exec_driver_sql("DROP TYPE IF EXISTS message")
+        engine.dispose()
+    yield
+
+HEADERS = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+
+class FakeGalaxy:
+    """Galaxy stand-in recording each batch as (email, url) pairs, None for removals."""
+    def __init__(self, preferences=(), missing=(), latency=0.0):
+        self.preferences = dict(preferences)
+        self.missing = list(missing)
+        self.latency = latency
+        self.called = threading.Event()
+        self.pages = 0
+        self.batches = []
+        self.closed = False
+
+    def get_preferences(self, after=None, limit=1000):
+        self.pages += 1
+        emails = sorted(email for email in self.preferences if after is None or email > after)
+        return [(email, self.preferences[email]) for email in emails[:limit]]
+
+    def sync_batch(self, changes):
+        self.called.set()
+        time.sleep(self.latency)
+        self.batches.append([(user.email, pulsar and pulsar.url) for user, pulsar in changes])
+        return [user.email for user, _ in changes if user.email in self.missing]
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def app():
+    return create_app(AppConfig(test = True))
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
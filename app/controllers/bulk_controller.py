@@ -0,0 +1,186 @@
+import json
+from http import HTTPStatus
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, text
+from sqlalchemy.orm import selectinload
+from models.model import Pulsar, Message
+from models.queries import get_or_create_users, add_outbox_messages
+from controllers.pulsar_controller import CreatePulsarBody
+from internal.responses import invalidate_pulsar, stream_ndjson
+from pydantic import BaseModel, ValidationError
+
+router = APIRouter()
+
+class BulkPulsarItem(CreatePulsarBody):
+    id: int | None = None
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: int | None = None
+    status: str  # created, updated or error
+    detail: str | None = None
+
+class BulkResponse(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    results: list[BulkItemResult]
+
+def _upsert_chunk(session, items):
+    """
+    Create or update a chunk of (index, item) pairs in one transaction.
+    Items with an unknown id are created with that id, so an export can be
+    restored as is. Returns the per-item results and the emails to
+    invalidate.
+    """
+    emails = [email for _, item in items for email in item.users]
+    users = {user.email: user for user in get_or_create_users(session, emails)}
+    ids = [item.id for _, item in items if item.id is not None]
+    result = session.execute(
+        select(Pulsar).where(Pulsar.id.in_(ids)).options(selectinload(Pulsar.users)).with_for_update())
+    existing = {pulsar.id: pulsar for pulsar in result.scalars()}
+
+    # Explicit ids first, so items without one are not given an id claimed later in the chunk
+    explicit = [(index, item) for index, item in items if item.id is not None]
+    generated = [(index, item) for index, item in items if item.id is None]
+    results = []
+    touched = []
+    for group in (explicit, generated):
+        if group is generated and ids and session.get_bind().dialect.name == "postgresql":
+            # Explicit ids do not advance the sequence
+            session.flush()
+            session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('pulsars', 'id'), (SELECT MAX(id) FROM pulsars))"))
+        for index, item in group:
+            pulsar_users = [users[email] for email in dict.fromkeys(item.users)]
+            pulsar = existing.get(item.id)
+            if pulsar is None:
+                pulsar = Pulsar(id=item.id, url=item.url, api_key=item.api_key, users=pulsar_users)
+                session.add(pulsar)
+                session.flush()
+                existing[pulsar.id] = pulsar
+                results.append(BulkItemResult(index=index, id=pulsar.id, status="created"))
+                touched.append((Message.CREATED, pulsar.id, pulsar_users))
+            else:
+                removed_users = [user for user in pulsar.users if user not in pulsar_users]
+                pulsar.url = item.url
+                pulsar.api_key = item.api_key
+                pulsar.users = pulsar_users
+                results.append(BulkItemResult(index=index, id=pulsar.id, status="updated"))
+                touched.append((Message.UPDATED, pulsar.id, pulsar_users + removed_users))
+    session.flush()
+
+    invalidated = []
+    for message, pulsar_id, pulsar_users in touched:
+        add_outbox_messages(session, message, pulsar_id, [user.id for user in pulsar_users])
+        invalidated.append((pulsar_id, [user.email for user in pulsar_users]))
+    session.commit()
+    return results, invalidated
+
+async def _iter_json_array(request, limit):
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array")
+    for item in items:
+        if len(json.dumps(item)) > limit:
+            yield None, "Item exceeds the request body limit"
+        else:
+            yield item, None
+
+async def _iter_ndjson(request, limit):
+    # Only one line is buffered at a time, oversized lines are skipped
+    buffer = b""
+    oversized = False
+    async for chunk in request.stream():
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            if oversized or len(line) > limit:
+                oversized = False
+                yield None, "Item exceeds the request body limit"
+            elif line.strip():
+                try:
+                    yield json.loads(line), None
+                except ValueError:
+                    yield None, "Invalid JSON"
+        if len(buffer) > limit:
+            buffer = b""
+            oversized = True
+    if oversized or len(buffer) > limit:
+        yield None, "Item exceeds the request body limit"
+    elif buffer.strip():
+        try:
+            yield json.loads(buffer), None
+        except ValueError:
+            yield None, "Invalid JSON"
+
+@router.post("/api/pulsar/bulk", status_code=HTTPStatus.OK)
+async def bulk_upsert_pulsars(request: Request) -> BulkResponse:
+    """
+    Create or update many pulsars from a JSON array, or from an NDJSON
+    stream when the content type is application/x-ndjson. Items are written
+    in chunked transactions and reported individually.
+    """
+    config = request.app.state.config.server
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = _iter_ndjson(request, config.request_body_limit)
+    else:
+        items = _iter_json_array(request, config.request_body_limit)
+
+    results = []
+    chunk = []
+
+    async def upsert(items):
+        try:
+            chunk_results, invalidated = await request.app.state.db.run(_upsert_chunk, items, write=True)
+        except Exception as e:
+            if len(items) > 1:
+                # Retry item by item, so one bad item does not fail the others
+                for item in items:
+                    await upsert([item])
+                return
+            chunk_results = [BulkItemResult(index=items[0][0], status="error", detail=str(e))]
+            invalidated = []
+        results.extend(chunk_results)
+        for pulsar_id, emails in invalidated:
+            invalidate_pulsar(request, pulsar_id, emails)
+
+    async def flush():
+        await upsert(list(chunk))
+        chunk.clear()
+
+    index = 0
+    async for item, error in items:
+        if error is None:
+            try:
+                chunk.append((index, BulkPulsarItem.model_validate(item)))
+            except ValidationError as e:
+                error = str(e)
+        if error is not None:
+            results.append(BulkItemResult(index=index, status="error", detail=error))
+        if len(chunk) >= config.bulk_chunk_size:
+            await flush()
+        index += 1
+    if chunk:
+        await flush()
+    request.app.state.outbox_event.set()
+
+    results.sort(key=lambda result: result.index)
+    return BulkResponse(
+        created=sum(result.status == "created" for result in results),
+        updated=sum(result.status == "updated" for result in results),
+        failed=sum(result.status == "error" for result in results),
+        results=results,
+    )
+
+@router.get("/api/pulsar/export", status_code=HTTPStatus.OK)
+async def export_pulsars(request: Request):
+    """Stream every pulsar as NDJSON, in a format accepted by the bulk endpoint."""
+    return StreamingResponse(
+        stream_ndjson(request.app.state.db),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,15 @@
+from http import HTTPStatus
+from fastapi import APIRouter, Request
+from pydantic import BaseModel
+
+router = APIRouter()
+
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+@router.get("/api/pulsar/cache/stats", status_code=HTTPStatus.OK)
+async def cache_stats(request: Request) -> CacheStatsResponse:
+    return CacheStatsResponse(**request.app.state.cache.stats())
@@ -0,0 +1,30 @@
+import datetime
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select, func
+from models.model import Outbox
+from internal.metrics import REGISTRY, OUTBOX_PENDING, OUTBOX_DEAD, OUTBOX_OLDEST_AGE
+
+router = APIRouter()
+
+def _outbox_backlog(session):
+    # Served by ix_outbox_pending, only pending rows are scanned
+    pending, oldest = session.execute(
+        select(func.count(), func.min(Outbox.created_at))
+        .where(Outbox.deleted_at == None)
+        .where(Outbox.dead_at == None)
+    ).one()
+    dead = session.execute(
+        select(func.count()).where(Outbox.deleted_at == None).where(Outbox.dead_at != None)
+    ).scalar()
+    return pending, dead, oldest
+
+@router.get("/api/pulsar/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Prometheus text exposition of the registry metrics."""
+    pending, dead, oldest = await request.app.state.db.run(_outbox_backlog)
+    OUTBOX_PENDING.set(pending)
+    OUTBOX_DEAD.set(dead)
+    age = (datetime.datetime.now() - oldest).total_seconds() if oldest is not None else 0
+    OUTBOX_OLDEST_AGE.set(max(age, 0))
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,70 @@
+import datetime
+from http import HTTPStatus
+from fastapi import APIRouter, Request, HTTPException
+from sqlalchemy import select, update
+from models.model import Outbox, Message
+from pydantic import BaseModel
+
+router = APIRouter()
+
+class DeadLetterResponse(BaseModel):
+    id: int
+    message: Message
+    user_id: int
+    pulsar_id: int
+    attempts: int
+    last_error: str | None
+    dead_at: datetime.datetime
+
+def _requeue(session, *conditions):
+    result = session.execute(
+        update(Outbox)
+        .where(Outbox.deleted_at == None, Outbox.dead_at != None, *conditions)
+        .values(
+            dead_at=None,
+            attempts=0,
+            next_attempt_at=None,
+            claimed_by=None,
+            lease_expires_at=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount
+
+def _list_dead_letters(session):
+    result = session.execute(
+        select(Outbox)
+        .where(Outbox.deleted_at == None, Outbox.dead_at != None)
+        .order_by(Outbox.id)
+    )
+    return [DeadLetterResponse(
+        id=task.id,
+        message=task.message,
+        user_id=task.user_id,
+        pulsar_id=task.pulsar_id,
+        attempts=task.attempts,
+        last_error=task.last_error,
+        dead_at=task.dead_at,
+    ) for task in result.scalars().all()]
+
+@router.get("/api/pulsar/outbox/dead", status_code=HTTPStatus.OK)
+async def list_dead_letters(request: Request) -> list[DeadLetterResponse]:
+    return await request.app.state.db.run(_list_dead_letters)
+
+class RequeueResponse(BaseModel):
+    requeued: int
+
+@router.post("/api/pulsar/outbox/dead/requeue", status_code=HTTPStatus.OK)
+async def requeue_dead_letters(request: Request) -> RequeueResponse:
+    requeued = await request.app.state.db.run(_requeue)
+    request.app.state.outbox_event.set()
+    return RequeueResponse(requeued=requeued)
+
+@router.post("/api/pulsar/outbox/dead/{task_id}/requeue", status_code=HTTPStatus.OK)
+async def requeue_dead_letter(request: Request, task_id: int) -> RequeueResponse:
+    requeued = await request.app.state.db.run(_requeue, Outbox.id == task_id)
+    if requeued == 0:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    request.app.state.outbox_event.set()
+    return RequeueResponse(requeued=requeued)
@@ -1,10 +1,18 @@
+import base64
+import hashlib
+import json
+import logging
 from http import HTTPStatus
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Request, Response, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
-from models.model import Pulsar, User, Outbox, Message
+from models.model import Pulsar, Message
+from models.queries import get_or_create_users, add_outbox_messages, find_pulsar, list_pulsars
+from internal.responses import invalidate_pulsar, stream_ndjson
 from pydantic import BaseModel, EmailStr
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class GetPulsarResponse(BaseModel):
     id: int
@@ -12,34 +20,90 @@ class GetPulsarResponse(BaseModel):
     api_key: str
     users: list[str]
 
-@router.get("/api/pulsar/{id}", status_code=HTTPStatus.OK)
-async def get_pulsar(request: Request, id: int) -> GetPulsarResponse:
-    with request.app.state.db.get_session() as session:
-        result = session.execute(select(Pulsar).where(Pulsar.id == id))
-        pulsar = result.scalar_one_or_none()
-        if pulsar is None:
-            raise HTTPException(status_code=404, detail="Pulsar not found")
-        response = GetPulsarResponse(
-            id=pulsar.id,
-            url=pulsar.url,
-            api_key=pulsar.api_key,
-            users=[user.email for user in pulsar.users],
+async def _cached(request, key, load, *args):
+    # Serve from the cache, otherwise run load(session, *args) off the event loop
+    cache = request.app.state.cache
+    hit, value, token = cache.get(key)
+    if not hit:
+        value = await request.app.state.db.run(load, *args)
+        cache.put(key, value, token)
+    return value
+
+def _etag(prefix, body: bytes) -> str:
+    # From the content, ids are reused after a delete or an explicit bulk import
+    return f'"{prefix}{hashlib.sha1(body).hexdigest()}"'
+
+def _not_modified(request: Request, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, ignore W/ prefixes
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+@router.get("/api/pulsar/{id}", status_code=HTTPStatus.OK, response_model=GetPulsarResponse)
+async def get_pulsar(request: Request, id: int):
+    pulsar = await _cached(request, ("pulsar", id), find_pulsar, id)
+    if pulsar is None:
+        raise HTTPException(status_code=404, detail="Pulsar not found")
+    responses = request.app.state.responses
+    body = responses.encode_pulsar(pulsar)
+    etag = _etag("p", body)
+    if _not_modified(request, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
+    return responses.response(request, body, {"ETag": etag})
+
+def _encode_cursor(pulsar_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": pulsar_id}).encode()).decode()
+
+def _decode_cursor(cursor: str | None) -> int | None:
+    if cursor is None:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+USER_CACHE_LIMIT = 1000  # Pulsars of a user cached whole, pages of users with more are read directly
+
+def _cacheable_user_pulsars(session, user):
+    # All the pulsars shared with user, or None when there are too many to cache
+    pulsars = list_pulsars(session, user, None, USER_CACHE_LIMIT + 1)
+    return pulsars if len(pulsars) <= USER_CACHE_LIMIT else None
+
+@router.get("/api/pulsar", status_code=HTTPStatus.OK, response_model=list[GetPulsarResponse])
+async def search_pulsar(
+    request: Request,
+    user: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
+    format: str | None = None,
+):
+    after = _decode_cursor(cursor)
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_ndjson(request.app.state.db, user, after),
+            media_type="application/x-ndjson",
         )
-        return response
-
-@router.get("/api/pulsar", status_code=HTTPStatus.OK)
-async def search_pulsar(request: Request, user = None):
-    if user is None:
-        raise HTTPException(status_code=400, detail="User not provided")
-    with request.app.state.db.get_session() as session:
-        result = session.execute(select(Pulsar).where(Pulsar.users.any(User.email == user)))
-        pulsars = result.scalars().all()
-        return [GetPulsarResponse(
-            id=pulsar.id,
-            url=pulsar.url,
-            api_key=pulsar.api_key,
-            users=[user.email for user in pulsar.users],
-        ) for pulsar in pulsars]
+    # A user usually shares few pulsars, cache them all and page in memory
+    pulsars = None if user is None else await _cached(request, ("user", user), _cacheable_user_pulsars, user)
+    if pulsars is None:
+        pulsars = await request.app.state.db.run(list_pulsars, user, after, limit + 1)
+    else:
+        pulsars = [pulsar for pulsar in pulsars if after is None or pulsar["id"] > after][:limit + 1]
+    next_cursor = None
+    if len(pulsars) > limit:
+        pulsars = pulsars[:limit]
+        next_cursor = _encode_cursor(pulsars[-1]["id"])
+    responses = request.app.state.responses
+    body = responses.encode_pulsars(pulsars)
+    etag = _etag("s", body + f";{next_cursor}".encode())
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    if _not_modified(request, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    return responses.response(request, body, headers)
 
 class CreatePulsarBody(BaseModel):
     url: str
@@ -51,87 +115,83 @@ class CreatePulsarBody(BaseModel):
 class CreatePulsarResponse(BaseModel):
     id: int
 
+def _create_pulsar(session, pulsar):
+    logger.info("Creating pulsar", extra={"url": pulsar.url, "users": len(pulsar.users)})
+    users = get_or_create_users(session, pulsar.users)
+
+    # Create new pulsar
+    new_pulsar = Pulsar(url=pulsar.url, api_key=pulsar.api_key, users=users)
+    session.add(new_pulsar)
+    session.flush()
+
+    # Create new outbox
+    add_outbox_messages(session, Message.CREATED, new_pulsar.id, [user.id for user in users])
+    emails = [user.email for user in users]
+
+    session.commit()
+    return new_pulsar.id, emails
+
 @router.post("/api/pulsar", status_code=HTTPStatus.CREATED)
 async def create_pulsar(request: Request, pulsar: CreatePulsarBody) -> CreatePulsarResponse:
-    with request.app.state.db.get_session() as session:
-        print(f"Creating pulsar: {pulsar}")
-        users = session.query(User).filter(User.email.in_(pulsar.users)).all()
-        users = []
-        for email in pulsar.users:
-            result = session.execute(select(User).where(User.email == email))
-            user = result.scalar_one_or_none()
-            if user is None:
-                print(f"Creating user: {email}")
-                user = User(email=email)
-                session.add(user)
-            users.append(user)
-        session.flush()
-        
-        # Create new pulsar
-        new_pulsar = Pulsar(url=pulsar.url, api_key=pulsar.api_key, users=users)
-        session.add(new_pulsar)
-        session.flush()
-
-        # Create new outbox
-        for user in new_pulsar.users:
-            new_outbox = Outbox(message=Message.CREATED, user_id=user.id, pulsar_id=new_pulsar.id)
-            session.add(new_outbox)
-
-        session.commit()
-        return CreatePulsarResponse(id=new_pulsar.id)
+    pulsar_id, emails = await request.app.state.db.run(_create_pulsar, pulsar, write=True)
+    request.app.state.outbox_event.set()
+    invalidate_pulsar(request, pulsar_id, emails)
+    return CreatePulsarResponse(id=pulsar_id)
+
+def _update_pulsar(session, pulsar_id, pulsar):
+    # First, check if pulsar exists
+    result = session.execute(select(Pulsar).where(Pulsar.id == pulsar_id).with_for_update())
+    existing_pulsar = result.scalar_one_or_none()
+    if existing_pulsar is None:
+        raise HTTPException(status_code=404, detail="Pulsar not found")
+
+    # Process users
+    users = get_or_create_users(session, pulsar.users)
+    removed_users = [user for user in existing_pulsar.users if user not in users]
+
+    # Update existing pulsar
+    existing_pulsar.url = pulsar.url
+    existing_pulsar.api_key = pulsar.api_key
+    existing_pulsar.users = users
+    session.flush()
+
+    # Create new outbox, removed users need their preference cleared too
+    add_outbox_messages(
+        session, Message.UPDATED, existing_pulsar.id, [user.id for user in users + removed_users])
+    emails = [user.email for user in users + removed_users]
+
+    session.commit()
+    return emails
 
 @router.put("/api/pulsar/{pulsar_id}", status_code=HTTPStatus.OK)
 async def update_pulsar(request: Request, pulsar_id: int, pulsar: CreatePulsarBody) -> CreatePulsarResponse:
-    with request.app.state.db.get_session() as session:
-        # First, check if pulsar exists
-        result = session.execute(select(Pulsar).where(Pulsar.id == pulsar_id))
-        existing_pulsar = result.scalar_one_or_none()
-        if existing_pulsar is None:
-            raise HTTPException(status_code=404, detail="Pulsar not found")
-
-        # Process users
-        users = []
-        for email in pulsar.users:
-            result = session.execute(select(User).where(User.email == email))
-            user = result.scalar_one_or_none()
-            if user is None:
-                user = User(email=email)
-                session.add(user)
-            users.append(user)
-        
-        # Update existing pulsar
-        existing_pulsar.url = pulsar.url
-        existing_pulsar.api_key = pulsar.api_key
-        existing_pulsar.users = users
-        
-        # Create new outbox
-        for user in existing_pulsar.users:
-            new_outbox = Outbox(message=Message.CREATED, user_id=user.id, pulsar_id=existing_pulsar.id)
-            session.add(new_outbox)
-
-        session.commit()
-        session.refresh(existing_pulsar)
-        return CreatePulsarResponse(id=existing_pulsar.id)
+    emails = await request.app.state.db.run(_update_pulsar, pulsar_id, pulsar, write=True)
+    request.app.state.outbox_event.set()
+    invalidate_pulsar(request, pulsar_id, emails)
+    return CreatePulsarResponse(id=pulsar_id)
 
 class DeleteResponse(BaseModel):
     pulsar_id: int
 
-@router.delete("/api/pulsar/{pulsar_id}", status_code=HTTPStatus.NO_CONTENT)
-async def delete_pulsar(request: Request, pulsar_id: int):
-    with request.app.state.db.get_session() as session:
-        result = session.execute(select(Pulsar).where(Pulsar.id == pulsar_id))
-        pulsar = result.scalar_one_or_none()
-        if pulsar is None:
-            raise HTTPException(status_code=404, detail="Pulsar not found")
+def _delete_pulsar(session, pulsar_id):
+    result = session.execute(select(Pulsar).where(Pulsar.id == pulsar_id).with_for_update())
+    pulsar = result.scalar_one_or_none()
+    if pulsar is None:
+        raise HTTPException(status_code=404, detail="Pulsar not found")
 
-        # create new outbox
-        for user in pulsar.users:
-            new_outbox = Outbox(message=Message.DELETED, user_id=user.id, pulsar_id=pulsar.id)
-            session.add(new_outbox)
+    # create new outbox
+    add_outbox_messages(session, Message.DELETED, pulsar.id, [user.id for user in pulsar.users])
+    emails = [user.email for user in pulsar.users]
 
-        # Delete pulsar
-        session.delete(pulsar)
+    # Delete pulsar
+    session.delete(pulsar)
 
-        session.commit()
-        return None 
+    session.commit()
+    return emails
 
+@router.delete("/api/pulsar/{pulsar_id}", status_code=HTTPStatus.NO_CONTENT)
+async def delete_pulsar(request: Request, pulsar_id: int):
+    emails = await request.app.state.db.run(_delete_pulsar, pulsar_id, write=True)
+    request.app.state.outbox_event.set()
+    invalidate_pulsar(request, pulsar_id, emails)
+    return None
@@ -0,0 +1,107 @@
+import json
+from http import HTTPStatus
+from controllers import bulk_controller
+from conftest import HEADERS
+
+def test_bulk_upsert_json_array(client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+
+    response = client.post(
+        "/api/pulsar/bulk",
+        json=[
+            {"id": 1, "url": "http://localhost:9090", "api_key": "1234567890", "users": ["b@test.com"]},
+            {"url": "http://localhost:8081", "api_key": "1234567890", "users": ["a@test.com", "b@test.com"]},
+            {"url": "http://localhost:8082"},
+        ],
+        headers=HEADERS,
+    )
+    assert response.status_code == HTTPStatus.OK
+    body = response.json()
+    assert (body["created"], body["updated"], body["failed"]) == (1, 1, 1)
+    assert [(result["index"], result["id"], result["status"]) for result in body["results"]] == [
+        (0, 1, "updated"),
+        (1, 2, "created"),
+        (2, None, "error"),
+    ]
+
+    response = client.get("/api/pulsar/1", headers=HEADERS)
+    assert response.json()["url"] == "http://localhost:9090"
+    assert response.json()["users"] == ["b@test.com"]
+
+def test_export_and_import_ndjson(client, app):
+    for i in range(3):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": [f"user{i}@test.com"]},
+            headers=HEADERS,
+        )
+    response = client.get("/api/pulsar/export", headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    exported = response.text
+    assert [json.loads(line)["id"] for line in exported.splitlines()] == [1, 2, 3]
+
+    # Restore into an empty registry, ids are kept
+    for i in range(1, 4):
+        client.delete(f"/api/pulsar/{i}", headers=HEADERS)
+    oversized = json.dumps({"url": "x" * app.state.config.server.request_body_limit, "api_key": "", "users": []})
+    response = client.post(
+        "/api/pulsar/bulk",
+        content=exported + oversized + "\nnot json\n",
+        headers={**HEADERS, "Content-Type": "application/x-ndjson"},
+    )
+    body = response.json()
+    assert (body["created"], body["updated"], body["failed"]) == (3, 0, 2)
+    assert body["results"][3]["detail"] == "Item exceeds the request body limit"
+    assert body["results"][4]["detail"] == "Invalid JSON"
+    assert client.get("/api/pulsar/export", headers=HEADERS).text == exported
+
+    response = client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": []},
+        headers=HEADERS,
+    )
+    assert response.json() == {"id": 4}
+
+def test_bulk_generated_ids_skip_explicit_ids(client):
+    response = client.post(
+        "/api/pulsar/bulk",
+        json=[
+            {"url": "http://localhost:8081", "api_key": "1234567890", "users": []},
+            {"id": 1, "url": "http://localhost:8080", "api_key": "1234567890", "users": []},
+        ],
+        headers=HEADERS,
+    )
+    body = response.json()
+    assert [(result["id"], result["status"]) for result in body["results"]] == [(2, "created"), (1, "created")]
+    response = client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8082", "api_key": "1234567890", "users": []},
+        headers=HEADERS,
+    )
+    assert response.json() == {"id": 3}
+
+def test_bulk_failed_chunk_is_retried_item_by_item(client, monkeypatch):
+    upsert_chunk = bulk_controller._upsert_chunk
+
+    def failing_upsert_chunk(session, items):
+        if any(item.url == "http://bad" for _, item in items):
+            raise ValueError("bad item")
+        return upsert_chunk(session, items)
+
+    monkeypatch.setattr(bulk_controller, "_upsert_chunk", failing_upsert_chunk)
+    response = client.post(
+        "/api/pulsar/bulk",
+        json=[
+            {"url": "http://localhost:8080", "api_key": "1234567890", "users": ["a@test.com"]},
+            {"url": "http://bad", "api_key": "1234567890", "users": ["a@test.com"]},
+            {"url": "http://localhost:8081", "api_key": "1234567890", "users": ["b@test.com"]},
+        ],
+        headers=HEADERS,
+    )
+    body = response.json()
+    assert (body["created"], body["updated"], body["failed"]) == (2, 0, 1)
+    assert body["results"][1] == {"index": 1, "id": None, "status": "error", "detail": "bad item"}
@@ -0,0 +1,38 @@
+from main import create_metrics_app
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from conftest import HEADERS
+
+def test_metrics(client):
+    response = client.get("/api/pulsar/metrics")
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["a@test.com", "b@test.com"]},
+        headers=HEADERS,
+    )
+    client.get("/api/pulsar/1", headers=HEADERS)
+
+    response = client.get("/api/pulsar/metrics", headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "pulsar_registry_outbox_pending 2.0" in lines
+    assert "pulsar_registry_outbox_dead 0.0" in lines
+    # Requests are labelled with their route template, not the raw path
+    assert any(line.startswith('pulsar_registry_request_duration_seconds_count{method="GET",route="/api/pulsar/{id}",status="200"}')
+               for line in lines)
+    assert any(line.startswith('pulsar_registry_request_db_queries_count{method="POST",route="/api/pulsar"}')
+               for line in lines)
+    assert any(line.startswith("pulsar_registry_db_query_duration_seconds_count") for line in lines)
+
+def test_worker_metrics_app(app):
+    client = TestClient(create_metrics_app(app))
+    assert client.get("/api/pulsar/metrics").status_code == HTTPStatus.FORBIDDEN
+
+    response = client.get("/api/pulsar/metrics", headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    assert "# TYPE pulsar_registry_worker_sweep_duration_seconds histogram" in response.text.splitlines()
+    # Only the metrics are served
+    assert client.get("/api/pulsar/1", headers=HEADERS).status_code == HTTPStatus.NOT_FOUND
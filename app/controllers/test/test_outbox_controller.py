@@ -0,0 +1,50 @@
+import datetime
+from models.model import Outbox
+from sqlalchemy import update
+from http import HTTPStatus
+from conftest import HEADERS
+
+def test_dead_letters(app, client):
+    response = client.get("/api/pulsar/outbox/dead")
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["test@test.com"]},
+        headers=HEADERS,
+    )
+    with app.state.db.get_session() as session:
+        session.execute(update(Outbox).values(
+            attempts=10,
+            last_error="User test@test.com not found",
+            dead_at=datetime.datetime(2025, 1, 1),
+        ))
+        session.commit()
+
+    # List dead letters
+    response = client.get("/api/pulsar/outbox/dead", headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [{
+        "id": 1,
+        "message": "CREATED",
+        "user_id": 1,
+        "pulsar_id": 1,
+        "attempts": 10,
+        "last_error": "User test@test.com not found",
+        "dead_at": "2025-01-01T00:00:00",
+    }]
+
+    # Requeue dead letter
+    response = client.post("/api/pulsar/outbox/dead/1/requeue", headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"requeued": 1}
+    assert app.state.outbox_event.is_set()
+
+    response = client.get("/api/pulsar/outbox/dead", headers=HEADERS)
+    assert response.json() == []
+
+    response = client.post("/api/pulsar/outbox/dead/1/requeue", headers=HEADERS)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    response = client.post("/api/pulsar/outbox/dead/requeue", headers=HEADERS)
+    assert response.json() == {"requeued": 0}
@@ -1,8 +1,13 @@
-import pytest
+import asyncio
+import json
+import httpx
 from main import create_app
-from fastapi.testclient import TestClient
 from internal.config import AppConfig
 from http import HTTPStatus
+from controllers import pulsar_controller
+from internal import responses
+from sqlalchemy import event
+from conftest import HEADERS
 
 def test_health(client):
     response = client.get("/api/pulsar/health")
@@ -85,10 +90,270 @@ def test_pulsar(client):
 
     assert response.status_code == HTTPStatus.NO_CONTENT
 
-@pytest.fixture
-def client():
+def test_search_pulsar_returns_all_users(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for users in (["a@test.com", "b@test.com"], ["b@test.com"], ["c@test.com"]):
+        client.post(
+            "/api/pulsar",
+            json={"url": "http://localhost:8080", "api_key": "1234567890", "users": users},
+            headers=headers,
+        )
+
+    response = client.get("/api/pulsar?user=b@test.com", headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    assert [(pulsar["id"], pulsar["users"]) for pulsar in response.json()] == [
+        (1, ["a@test.com", "b@test.com"]),
+        (2, ["b@test.com"]),
+    ]
+
+    response = client.get("/api/pulsar?user=unknown@test.com", headers=headers)
+    assert response.json() == []
+
+    response = client.get("/api/pulsar/4", headers=headers)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+def test_list_pulsar_pages(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for i in range(5):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": [f"user{i}@test.com"]},
+            headers=headers,
+        )
+
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        response = client.get("/api/pulsar", params=params, headers=headers)
+        assert response.status_code == HTTPStatus.OK
+        ids.append([pulsar["id"] for pulsar in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert ids == [[1, 2], [3, 4], [5]]
+
+    response = client.get("/api/pulsar?cursor=invalid", headers=headers)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+def test_user_with_many_pulsars_is_paged_from_the_database(client, monkeypatch):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for i in range(5):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": ["test@test.com"]},
+            headers=headers,
+        )
+    monkeypatch.setattr(pulsar_controller, "USER_CACHE_LIMIT", 3)
+
+    ids = []
+    cursor = None
+    while True:
+        params = {"user": "test@test.com", "limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/api/pulsar", params=params, headers=headers)
+        ids.append([pulsar["id"] for pulsar in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert ids == [[1, 2], [3, 4], [5]]
+    # Only a marker is cached, not the user's pulsars
+    assert client.app.state.cache.get(("user", "test@test.com"))[1] is None
+
+def test_stream_pulsar_ndjson(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for i in range(3):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": ["test@test.com"]},
+            headers=headers,
+        )
+
+    response = client.get("/api/pulsar?format=ndjson&user=test@test.com", headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [pulsar["url"] for pulsar in lines] == ["http://localhost:0", "http://localhost:1", "http://localhost:2"]
+    assert lines[0]["users"] == ["test@test.com"]
+
+def test_stream_reads_pages_through_the_database_limiter(client, monkeypatch):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for i in range(5):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": []},
+            headers=headers,
+        )
+    db = client.app.state.db
+    run = db.run
+    pages = []
+
+    async def counting_run(fn, *args):
+        pages.append(args)
+        return await run(fn, *args)
+
+    monkeypatch.setattr(responses, "STREAM_PAGE_SIZE", 2)
+    monkeypatch.setattr(db, "run", counting_run)
+    response = client.get("/api/pulsar/export", headers=headers)
+
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1, 2, 3, 4, 5]
+    assert [after for _, after, _ in pages] == [None, 2, 4]
+
+def test_concurrent_updates_of_one_pulsar(tmp_path):
     config = AppConfig(test = True)
+    if config.database.url is None:
+        # The in-memory database runs one request at a time
+        config.database.in_memory = False
+        config.database.path = str(tmp_path / "registry.db")
+    config.database.debug = False
     app = create_app(config)
-    client = TestClient(app)
-    return client
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post(
+                "/api/pulsar", json={"url": "http://pulsar", "api_key": "key", "users": []}, headers=headers)
+            responses = await asyncio.gather(*(
+                client.put(
+                    "/api/pulsar/1",
+                    json={"url": "http://pulsar", "api_key": "key", "users": [f"user{i % 5}@test.com", "a@test.com"]},
+                    headers=headers,
+                )
+                for i in range(50)
+            ))
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(run()) == [HTTPStatus.OK] * 50
+    app.state.db.engine.dispose()
+
+def test_write_query_count_does_not_grow_with_the_users(client):
+    statements = []
+    event.listen(client.app.state.db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    users = [f"user{i}@test.com" for i in range(100)]
+    response = client.post(
+        "/api/pulsar", json={"url": "http://pulsar", "api_key": "key", "users": users}, headers=HEADERS)
+    assert response.status_code == HTTPStatus.CREATED
+    # Users, pulsar, links and outbox rows, each in one statement
+    assert len(statements) <= 6
+
+    statements.clear()
+    users = [f"other{i}@test.com" for i in range(100)] + users[:50]
+    response = client.put(
+        f"/api/pulsar/{response.json()['id']}",
+        json={"url": "http://pulsar", "api_key": "key", "users": users},
+        headers=HEADERS,
+    )
+    assert response.status_code == HTTPStatus.OK
+    # The pulsar and its current users are loaded once, the changes are written in bulk
+    assert len(statements) <= 7
+
+def test_cached_lookups_are_invalidated_on_write(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["a@test.com", "b@test.com"]},
+        headers=headers,
+    )
+    for _ in range(2):
+        client.get("/api/pulsar/1", headers=headers)
+        client.get("/api/pulsar?user=b@test.com", headers=headers)
+    response = client.get("/api/pulsar/cache/stats", headers=headers)
+    assert response.json() == {"hits": 2, "misses": 2, "evictions": 0, "size": 2}
+
+    client.put(
+        "/api/pulsar/1",
+        json={"url": "http://localhost:9090", "api_key": "1234567890", "users": ["a@test.com"]},
+        headers=headers,
+    )
+    response = client.get("/api/pulsar/1", headers=headers)
+    assert response.json()["url"] == "http://localhost:9090"
+    response = client.get("/api/pulsar?user=b@test.com", headers=headers)
+    assert response.json() == []
+
+    client.delete("/api/pulsar/1", headers=headers)
+    response = client.get("/api/pulsar/1", headers=headers)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    response = client.get("/api/pulsar?user=a@test.com", headers=headers)
+    assert response.json() == []
 
+def test_conditional_get(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["test@test.com"]},
+        headers=headers,
+    )
+
+    response = client.get("/api/pulsar/1", headers=headers)
+    etag = response.headers["ETag"]
+    response = client.get("/api/pulsar/1", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/api/pulsar?user=test@test.com", headers=headers)
+    search_etag = response.headers["ETag"]
+    response = client.get("/api/pulsar?user=test@test.com", headers={**headers, "If-None-Match": search_etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    # Changing the users changes the ETag
+    client.put(
+        "/api/pulsar/1",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["test@test.com", "new@test.com"]},
+        headers=headers,
+    )
+    response = client.get("/api/pulsar/1", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != etag
+    assert response.json()["users"] == ["test@test.com", "new@test.com"]
+    response = client.get("/api/pulsar?user=test@test.com", headers={**headers, "If-None-Match": search_etag})
+    assert response.status_code == HTTPStatus.OK
+
+def test_etag_changes_when_an_id_is_reused(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://localhost:8080", "api_key": "1234567890", "users": ["test@test.com"]},
+        headers=headers,
+    )
+    etag = client.get("/api/pulsar/1", headers=headers).headers["ETag"]
+    client.delete("/api/pulsar/1", headers=headers)
+    # Imported with the deleted pulsar's id
+    client.post(
+        "/api/pulsar/bulk",
+        content='{"id": 1, "url": "http://localhost:9090", "api_key": "other", "users": ["test@test.com"]}\n',
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+
+    response = client.get("/api/pulsar/1", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["url"] == "http://localhost:9090"
+
+def test_encoded_responses_are_reused(client):
+    headers = {"Authorization": "Bearer PULSAR_REGISTRY_KEY"}
+    for i in range(20):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://localhost:{i}", "api_key": "1234567890", "users": ["test@test.com"]},
+            headers=headers,
+        )
+    responses = client.app.state.responses
+
+    for _ in range(2):
+        response = client.get("/api/pulsar?user=test@test.com", headers={**headers, "Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()) == 20
+    # Each pulsar was encoded once and the page compressed once
+    assert responses.encoded.stats()["size"] == 20
+    assert responses.compressed.stats()["hits"] == 1
+
+    client.put(
+        "/api/pulsar/1",
+        json={"url": "http://localhost:9090", "api_key": "1234567890", "users": ["test@test.com"]},
+        headers=headers,
+    )
+    response = client.get("/api/pulsar?user=test@test.com", headers={**headers, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json()[0] == {
+        "id": 1, "url": "http://localhost:9090", "api_key": "1234567890", "users": ["test@test.com"]}
@@ -1,5 +1,12 @@
 import psycopg2
+import psycopg2.pool
 import json
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from internal.metrics import GALAXY_CALL_DURATION, GALAXY_ERRORS
 
 """
 SELECT id FROM galaxy_user where email = $1
@@ -9,93 +16,209 @@ INSERT INTO user_preference (user_id, name, value) VALUES ($1, $2, $3)
 ----+---------+------------------------+-------------------------------------------------------------
   1 |       2 | extra_user_preferences | {"accp|pulsar_host": "test", "accp|pulsar_api_key": "test"}
 """
+PREFERENCE_NAME = "extra_user_preferences"
+PULSAR_HOST = "accp|pulsar_host"
+PULSAR_API_KEY = "accp|pulsar_api_key"
+
+logger = logging.getLogger(__name__)
+
+class GalaxyUnavailableError(Exception):
+    """Galaxy's database could not be reached, as opposed to a failed change."""
+
+def _instrumented(operation):
+    # Record the latency and failures of a Galaxy call
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                GALAXY_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                GALAXY_CALL_DURATION.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+def _preference_value(pulsar):
+    return json.dumps({
+        PULSAR_HOST: pulsar.url,
+        PULSAR_API_KEY: pulsar.api_key})
+
+def _decode_preferences(value):
+    """Return a stored value as a dict, or None when it isn't a JSON object."""
+    try:
+        value = json.loads(value or "{}")
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
 class Galaxy:
     def __init__(self, config):
-        self.conn = psycopg2.connect(config.galaxy_database)
+        # One connection per worker thread plus one for the reconciler
+        size = config.worker.concurrency + 1
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, size, config.galaxy_database)
+        # The pool raises when exhausted, callers wait for a connection instead
+        self.slots = threading.BoundedSemaphore(size)
 
-    def _get_user_id(self, cur, email):
-        print(f"Getting user id for {email}")
-        cur.execute("""
-            SELECT id FROM galaxy_user WHERE email = %s
-        """, [email])
-        return cur.fetchone()
+    @contextmanager
+    def _connection(self):
+        with self.slots:
+            try:
+                conn = self.pool.getconn()
+                if conn.closed:
+                    # Replace connections dropped while idle in the pool
+                    self.pool.putconn(conn, close=True)
+                    conn = self.pool.getconn()
+            except (psycopg2.OperationalError, psycopg2.pool.PoolError) as e:
+                raise GalaxyUnavailableError(str(e)) from e
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self.pool.putconn(conn, close=True)
+                raise GalaxyUnavailableError(str(e)) from e
+            except Exception:
+                conn.rollback()
+                self.pool.putconn(conn)
+                raise
+            else:
+                self.pool.putconn(conn)
 
-    def _get_user_preference(self, cur, user):
-        print(f"Getting user preference for {user.email}")
-        cur.execute("""
-            SELECT * 
-            FROM user_preference 
-            WHERE user_id = (SELECT id FROM galaxy_user WHERE email = %s)
-        """, [user.email])
-        return cur.fetchone()
-    
-    def _update_user_preference(self, cur, user, pulsar):
-        print(f"Updating user preference for {user.email}")
-        value = json.dumps({
-            "accp|pulsar_host": pulsar.url, 
-            "accp|pulsar_api_key": pulsar.api_key})
-        cur.execute("""
-            UPDATE user_preference 
-            SET value = %s 
-            WHERE user_id = (SELECT id FROM galaxy_user WHERE email = %s)
-        """, (
-            value,
-            user.email
-        ))
-
-    def _insert_user_preference(self, cur, user, pulsar):
-        print(f"Inserting user preference for {user.email}")
-        value = json.dumps({
-            "accp|pulsar_host": pulsar.url, 
-            "accp|pulsar_api_key": pulsar.api_key})
+    def close(self):
+        self.pool.closeall()
+
+    def _merge_preferences(self, cur, changes):
+        """
+        Merge {email: patch} into the users' extra_user_preferences in one
+        round trip, returning the emails without a galaxy_user.
+
+        Only the pulsar keys are replaced, other preferences are kept, and
+        rows whose value would not change are not written. user_preference
+        has no unique constraint to use with ON CONFLICT, so the UPDATE and
+        the INSERT ... WHERE NOT EXISTS are one statement, and concurrent
+        writers to the same user are serialized with advisory locks. Values
+        that aren't a JSON object would make the cast abort the whole
+        statement, so they are read first and replaced as if empty.
+        """
+        logger.debug("Merging user preferences", extra={"users": len(changes)})
         cur.execute("""
-            INSERT INTO user_preference (user_id, name, value) 
-            VALUES (
-                (SELECT id FROM galaxy_user WHERE email = %s), 
-                %s, 
-                %s
-            )
-        """, (
-            user.email, 
-            "extra_user_preferences",
-            value
-        ))
-
-    def _upsert_user_preference(self, cur, user, pulsar):
-        existing_preference = self._get_user_preference(cur, user)
-        if existing_preference is None:
-            self._insert_user_preference(cur, user, pulsar)
-        else:
-            self._update_user_preference(cur, user, pulsar)
-
-    def _remove_user_preference(self, cur, user):
-        print(f"Removing user preference for {user.email}")
+            SELECT pg_advisory_xact_lock(hashtext(%(name)s), id)
+            FROM galaxy_user WHERE email = ANY(%(emails)s) ORDER BY id;
+
+            SELECT p.user_id, p.value
+            FROM user_preference AS p JOIN galaxy_user AS u ON u.id = p.user_id
+            WHERE u.email = ANY(%(emails)s) AND p.name = %(name)s
+        """, {"name": PREFERENCE_NAME, "emails": list(changes.keys())})
+        invalid = [user_id for user_id, value in cur.fetchall() if _decode_preferences(value) is None]
+
         cur.execute("""
-            DELETE FROM user_preference WHERE user_id = (
-                SELECT id FROM galaxy_user WHERE email = %s
+            WITH changes AS (
+                SELECT c.email, u.id AS user_id, c.patch
+                FROM unnest(%(emails)s::text[], %(patches)s::jsonb[]) AS c(email, patch)
+                LEFT JOIN galaxy_user AS u ON u.email = c.email
+            ),
+            current AS (
+                SELECT p.id, c.patch, (CASE WHEN p.user_id = ANY(%(invalid)s::int[]) THEN '{}'
+                    ELSE COALESCE(NULLIF(p.value, ''), '{}') END)::jsonb AS value
+                FROM user_preference AS p JOIN changes AS c ON p.user_id = c.user_id
+                WHERE p.name = %(name)s
+            ),
+            updated AS (
+                UPDATE user_preference AS p
+                SET value = ((c.value - %(keys)s::text[]) || c.patch)::text
+                FROM current AS c
+                WHERE p.id = c.id
+                AND (((c.value - %(keys)s::text[]) || c.patch) <> c.value
+                    OR p.user_id = ANY(%(invalid)s::int[]))
+            ),
+            inserted AS (
+                INSERT INTO user_preference (user_id, name, value)
+                SELECT c.user_id, %(name)s, c.patch::text
+                FROM changes AS c
+                WHERE c.user_id IS NOT NULL AND c.patch <> '{}'::jsonb
+                AND NOT EXISTS (
+                    SELECT 1 FROM user_preference AS p
+                    WHERE p.user_id = c.user_id AND p.name = %(name)s
+                )
             )
-        """, (user.email))
-    
+            SELECT email FROM changes WHERE user_id IS NULL
+        """, {
+            "name": PREFERENCE_NAME,
+            "keys": [PULSAR_HOST, PULSAR_API_KEY],
+            "emails": list(changes.keys()),
+            "patches": list(changes.values()),
+            "invalid": invalid,
+        })
+        return [row[0] for row in cur.fetchall()]
+
+    @_instrumented("update_pulsar")
     def update_pulsar(self, user, pulsar):
         try:
-            cur = self.conn.cursor()
-            user_id = self._get_user_id(cur, user.email)
-            if user_id is None:
-                raise Exception(f"User {user.email} not found")
-            self._upsert_user_preference(cur, user, pulsar)
-            self.conn.commit()
+            with self._connection() as conn:
+                missing = self._merge_preferences(conn.cursor(), {user.email: _preference_value(pulsar)})
+                if missing:
+                    raise Exception(f"User {user.email} not found")
+                conn.commit()
+        except GalaxyUnavailableError:
+            raise
         except Exception as e:
-            self.conn.rollback()
             raise Exception(f"Failed to update pulsar for {user.email}: {e}")
-    
+
+    @_instrumented("remove_pulsar")
     def remove_pulsar(self, user):
         try:
-            cur = self.conn.cursor()
-            user_id = self._get_user_id(cur, user.email)
-            if user_id is None:
-                raise Exception(f"User {user.email} not found")
-            self._remove_user_preference(cur, user)
-            self.conn.commit()
+            with self._connection() as conn:
+                missing = self._merge_preferences(conn.cursor(), {user.email: "{}"})
+                if missing:
+                    raise Exception(f"User {user.email} not found")
+                conn.commit()
+        except GalaxyUnavailableError:
+            raise
         except Exception as e:
-            self.conn.rollback()
             raise Exception(f"Failed to remove pulsar for {user.email}: {e}")
+
+    @_instrumented("get_preferences")
+    def get_preferences(self, after=None, limit=1000):
+        """
+        Return the next limit (email, value) pairs of users with an
+        extra_user_preferences row, ordered by email in code point order.
+        The value is the decoded JSON object, or None when it is not valid
+        JSON. Each call is a short read, so pages can be throttled freely.
+        """
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT DISTINCT ON (u.email COLLATE "C") u.email, p.value
+                FROM user_preference AS p
+                JOIN galaxy_user AS u ON u.id = p.user_id
+                WHERE p.name = %s AND (%s IS NULL OR u.email COLLATE "C" > %s)
+                ORDER BY u.email COLLATE "C", p.id
+                LIMIT %s
+            """, (PREFERENCE_NAME, after, after, limit))
+            rows = cur.fetchall()
+            conn.rollback()
+        return [(email, _decode_preferences(value)) for email, value in rows]
+
+    @_instrumented("sync_batch")
+    def sync_batch(self, changes):
+        """
+        Apply a batch of (user, pulsar) changes in a single transaction.
+        A pulsar of None removes the user's pulsar settings. When a user
+        appears more than once, the last change wins. Returns the emails
+        that have no matching galaxy_user; their changes are skipped.
+        """
+        latest = {}
+        for user, pulsar in changes:
+            latest[user.email] = "{}" if pulsar is None else _preference_value(pulsar)
+        if len(latest) == 0:
+            return []
+        try:
+            with self._connection() as conn:
+                missing = self._merge_preferences(conn.cursor(), latest)
+                conn.commit()
+        except GalaxyUnavailableError:
+            raise  # Kept apart, the worker retries it without counting an attempt
+        except Exception as e:
+            raise Exception(f"Failed to sync batch of {len(latest)} users: {e}")
+        return missing
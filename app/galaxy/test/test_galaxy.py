@@ -0,0 +1,95 @@
+import os
+import json
+import pytest
+import psycopg2
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from internal.config import AppConfig
+from galaxy.galaxy import Galaxy
+
+# Needs an empty Postgres database that may be wiped
+DSN = os.environ.get("PULSAR_REGISTRY_TEST_GALAXY_DATABASE")
+pytestmark = pytest.mark.skipif(DSN is None, reason="PULSAR_REGISTRY_TEST_GALAXY_DATABASE is not set")
+
+User = namedtuple("User", ["email"])
+Pulsar = namedtuple("Pulsar", ["url", "api_key"])
+
+def preferences(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT user_id, value, xmin::text FROM user_preference WHERE name = 'extra_user_preferences' ORDER BY user_id")
+        rows = cur.fetchall()
+    conn.commit()
+    return {user_id: (json.loads(value), xmin) for user_id, value, xmin in rows}
+
+def test_sync_batch_merges_pulsar_keys(galaxy, conn):
+    missing = galaxy.sync_batch([
+        (User("a@test.com"), Pulsar("http://pulsar1", "key1")),
+        (User("b@test.com"), Pulsar("http://pulsar2", "key2")),
+        (User("c@test.com"), None),
+        (User("unknown@test.com"), Pulsar("http://pulsar1", "key1")),
+    ])
+    assert missing == ["unknown@test.com"]
+    rows = preferences(conn)
+    # Other preferences are kept, and removing from a user without a row inserts nothing
+    assert rows[1][0] == {"theme": "dark", "accp|pulsar_host": "http://pulsar1", "accp|pulsar_api_key": "key1"}
+    assert rows[2][0] == {"accp|pulsar_host": "http://pulsar2", "accp|pulsar_api_key": "key2"}
+    assert 3 not in rows
+
+    # Unchanged values are not rewritten
+    galaxy.sync_batch([(User("a@test.com"), Pulsar("http://pulsar1", "key1"))])
+    assert preferences(conn)[1][1] == rows[1][1]
+
+    galaxy.remove_pulsar(User("a@test.com"))
+    assert preferences(conn)[1][0] == {"theme": "dark"}
+
+def test_sync_batch_replaces_invalid_preferences(galaxy, conn):
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO user_preference (user_id, name, value) VALUES (2, 'extra_user_preferences', 'not json'), (3, 'extra_user_preferences', '[1]')")
+    conn.commit()
+    # The other users of the batch are still written
+    galaxy.sync_batch([
+        (User("a@test.com"), Pulsar("http://pulsar1", "key1")),
+        (User("b@test.com"), Pulsar("http://pulsar2", "key2")),
+        (User("c@test.com"), None),
+    ])
+    rows = preferences(conn)
+    assert rows[1][0]["accp|pulsar_host"] == "http://pulsar1"
+    assert rows[2][0] == {"accp|pulsar_host": "http://pulsar2", "accp|pulsar_api_key": "key2"}
+    assert rows[3][0] == {}
+
+def test_get_preferences_pages_in_code_point_order(galaxy):
+    galaxy.sync_batch([(User(email), Pulsar("http://pulsar", "key")) for email in ["a@test.com", "B@test.com"]])
+    assert [email for email, _ in galaxy.get_preferences(limit=1)] == ["B@test.com"]
+    assert galaxy.get_preferences(after="B@test.com") == [
+        ("a@test.com", {"theme": "dark", "accp|pulsar_host": "http://pulsar", "accp|pulsar_api_key": "key"})]
+
+def test_callers_wait_for_a_connection(galaxy):
+    # More concurrent callers than pooled connections, e.g. the worker and the reconciler
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: galaxy.get_preferences(), range(32)))
+    assert all(len(result) == 1 for result in results)
+
+@pytest.fixture
+def conn():
+    conn = psycopg2.connect(DSN)
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS user_preference, galaxy_user")
+        cur.execute("CREATE TABLE galaxy_user (id SERIAL PRIMARY KEY, email VARCHAR(255) NOT NULL)")
+        cur.execute("""
+            CREATE TABLE user_preference (
+                id SERIAL PRIMARY KEY, user_id INTEGER REFERENCES galaxy_user (id), name VARCHAR(255), value TEXT)
+        """)
+        cur.execute("INSERT INTO galaxy_user (email) VALUES ('a@test.com'), ('b@test.com'), ('c@test.com'), ('B@test.com')")
+        cur.execute("""INSERT INTO user_preference (user_id, name, value) VALUES (1, 'extra_user_preferences', '{"theme": "dark"}')""")
+    conn.commit()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def galaxy(conn):
+    config = AppConfig(test = True)
+    config.galaxy_database = DSN
+    config.worker.concurrency = 1
+    galaxy = Galaxy(config)
+    yield galaxy
+    galaxy.close()
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ReadCache:
+    """
+    Bounded LRU cache with a TTL for read lookups.
+
+    Writers call invalidate after committing. A value loaded while an
+    invalidation happened is returned but not stored, so a read racing a
+    write can never put stale data back in the cache.
+    """
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.epoch = 0  # Bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return (hit, value, token). On a miss, pass the token to put so the
+        loaded value is dropped if an invalidation happened meanwhile.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], None
+            self.misses += 1
+            return False, None, self.epoch
+
+    def put(self, key, value, token):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if self.epoch != token:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, load):
+        hit, value, token = self.get(key)
+        if not hit:
+            value = load()
+            self.put(key, value, token)
+        return value
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.epoch += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
@@ -6,38 +6,183 @@ def to_absolute_path(filename: str) -> str:
     return os.path.join(current_dir, filename)
 
 class AppConfig:
-    def __init__(self, test = False):
+    def __init__(self, test = False, path = None):
         config = configparser.ConfigParser()
-        config_file_path = "config.ini" if os.path.exists("config.ini") else "config.ini.sample"
+        # config.ini in the working directory unless a file is given
+        config_file_path = path or ("config.ini" if os.path.exists("config.ini") else "config.ini.sample")
         config.read(config_file_path)
         host = config["DEFAULT"]["Host"]
         port = int(config["DEFAULT"]["Port"])
         request_body_limit = int(config["DEFAULT"]["RequestBodyLimit"])
+        bulk_chunk_size = int(config["DEFAULT"].get("BulkChunkSize", "100"))
+        workers = int(config["DEFAULT"].get("Workers", "1"))
+        outbox_worker = config["DEFAULT"].get("OutboxWorker", "embedded")
+        shutdown_timeout = float(config["DEFAULT"].get("ShutdownTimeout", "30"))
+        worker_metrics_port = int(config["DEFAULT"].get("WorkerMetricsPort", "0"))
         api_key = config["DEFAULT"]["ApiKey"]
+        api_keys = _parse_api_keys(config["DEFAULT"].get("ApiKeys", ""))
+        rate_limit = float(config["DEFAULT"].get("RateLimit", "0"))
+        rate_limit_burst = int(config["DEFAULT"].get("RateLimitBurst", "50"))
+        outbox_backlog_limit = int(config["DEFAULT"].get("OutboxBacklogLimit", "0"))
+        outbox_backlog_retry_after = int(config["DEFAULT"].get("OutboxBacklogRetryAfter", "30"))
+        outbox_backlog_check_interval = float(config["DEFAULT"].get("OutboxBacklogCheckInterval", "1"))
         in_memory = True if test else config["DEFAULT"]["InMemory"] == "true"
+        database_url = config["DEFAULT"].get("DatabaseUrl") or None
+        if test and os.environ.get("PULSAR_REGISTRY_TEST_DATABASE_URL"):
+            # Run the test suite against another backend, e.g. a local Postgres
+            database_url = os.environ["PULSAR_REGISTRY_TEST_DATABASE_URL"]
+        if database_url:
+            in_memory = False  # DatabaseUrl overrides InMemory and DatabasePath
         debug = config["DEFAULT"]["Debug"] == "true"
+        database_threads = int(config["DEFAULT"].get("DatabaseThreads", "16"))
+        database_pool_size = int(config["DEFAULT"].get("DatabasePoolSize", "20"))
+        database_max_overflow = int(config["DEFAULT"].get("DatabaseMaxOverflow", "10"))
+        database_pool_recycle = int(config["DEFAULT"].get("DatabasePoolRecycle", "3600"))
+        database_journal_mode = config["DEFAULT"].get("DatabaseJournalMode", "WAL")
+        database_synchronous = config["DEFAULT"].get("DatabaseSynchronous", "NORMAL")
+        database_busy_timeout = int(config["DEFAULT"].get("DatabaseBusyTimeout", "5000"))
+        database_mmap_size = int(config["DEFAULT"].get("DatabaseMmapSize", "268435456"))
+        database_cache_size = int(config["DEFAULT"].get("DatabaseCacheSize", "-65536"))
         galaxy_database = config["DEFAULT"]["GalaxyDatabase"]
+        worker_batch_size = int(config["DEFAULT"].get("WorkerBatchSize", "500"))
+        worker_debounce = float(config["DEFAULT"].get("WorkerDebounce", "0.2"))
+        worker_poll_interval = float(config["DEFAULT"].get("WorkerPollInterval", "60"))
+        worker_concurrency = int(config["DEFAULT"].get("WorkerConcurrency", "4"))
+        worker_lease_duration = float(config["DEFAULT"].get("WorkerLeaseDuration", "60"))
+        worker_max_attempts = int(config["DEFAULT"].get("WorkerMaxAttempts", "10"))
+        worker_retry_base_delay = float(config["DEFAULT"].get("WorkerRetryBaseDelay", "5"))
+        worker_retry_max_delay = float(config["DEFAULT"].get("WorkerRetryMaxDelay", "3600"))
+        retention_ttl = float(config["DEFAULT"].get("RetentionTtl", "604800"))
+        retention_interval = float(config["DEFAULT"].get("RetentionInterval", "3600"))
+        retention_batch_size = int(config["DEFAULT"].get("RetentionBatchSize", "1000"))
+        retention_vacuum_threshold = int(config["DEFAULT"].get("RetentionVacuumThreshold", "100000"))
+        cache_size = int(config["DEFAULT"].get("CacheSize", "10000"))
+        cache_ttl = float(config["DEFAULT"].get("CacheTtl", "60"))
+        cache_gzip = config["DEFAULT"].get("CacheGzip", "true") == "true"
+        cache_shared_ttl = float(config["DEFAULT"].get("CacheSharedTtl", "2"))
+        reconcile_interval = float(config["DEFAULT"].get("ReconcileInterval", "3600"))
+        reconcile_chunk_size = int(config["DEFAULT"].get("ReconcileChunkSize", "1000"))
+        reconcile_batch_size = int(config["DEFAULT"].get("ReconcileBatchSize", "100"))
+        reconcile_throttle = float(config["DEFAULT"].get("ReconcileThrottle", "0.5"))
+        reconcile_dry_run = config["DEFAULT"].get("ReconcileDryRun", "false") == "true"
+        log_level = config["DEFAULT"].get("LogLevel", "INFO")
+        log_format = config["DEFAULT"].get("LogFormat", "text")
 
-        self.server = ServerConfig(host, port, request_body_limit)
-        self.auth = AuthConfig(api_key)
-        self.database = DatabaseConfig(to_absolute_path(config["DEFAULT"]["DatabasePath"]), in_memory, debug)
+        self.server = ServerConfig(
+            host, port, request_body_limit, bulk_chunk_size, workers, outbox_worker, shutdown_timeout,
+            worker_metrics_port)
+        self.auth = AuthConfig(api_key, api_keys)
+        self.admission = AdmissionConfig(
+            rate_limit, rate_limit_burst, outbox_backlog_limit, outbox_backlog_retry_after,
+            outbox_backlog_check_interval)
+        self.database = DatabaseConfig(
+            to_absolute_path(config["DEFAULT"]["DatabasePath"]), in_memory, debug, database_threads,
+            database_pool_size, database_journal_mode, database_synchronous, database_busy_timeout,
+            database_mmap_size, database_cache_size, database_url, database_max_overflow, database_pool_recycle)
         self.galaxy_database = galaxy_database
+        self.worker = WorkerConfig(
+            worker_batch_size, worker_debounce, worker_poll_interval, worker_concurrency, worker_lease_duration,
+            worker_max_attempts, worker_retry_base_delay, worker_retry_max_delay)
+        self.retention = RetentionConfig(
+            retention_ttl, retention_interval, retention_batch_size, retention_vacuum_threshold)
+        self.cache = CacheConfig(cache_size, cache_ttl, cache_gzip, cache_shared_ttl)
+        self.reconcile = ReconcileConfig(
+            reconcile_interval, reconcile_chunk_size, reconcile_batch_size, reconcile_throttle, reconcile_dry_run)
+        self.log = LogConfig(log_level, log_format)
 
 class DatabaseConfig: 
-    def __init__(self, path, in_memory=False, debug=False):
+    def __init__(self, path, in_memory=False, debug=False, threads=16, pool_size=20, journal_mode="WAL",
+                 synchronous="NORMAL", busy_timeout=5000, mmap_size=268435456, cache_size=-65536, url=None,
+                 max_overflow=10, pool_recycle=3600):
         self.path = path
         self.in_memory = in_memory
         self.debug = debug
+        self.threads = threads
+        self.pool_size = pool_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout  # Milliseconds to wait for a lock
+        self.mmap_size = mmap_size  # Bytes
+        self.cache_size = cache_size  # Pages, or KiB when negative
+        self.url = url  # Any SQLAlchemy URL, overrides path when set
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle  # Seconds before a pooled connection is replaced
+
+class WorkerConfig:
+    def __init__(self, batch_size=500, debounce=0.2, poll_interval=60, concurrency=4, lease_duration=60,
+                 max_attempts=10, retry_base_delay=5, retry_max_delay=3600):
+        self.batch_size = batch_size
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.concurrency = concurrency
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+class RetentionConfig:
+    def __init__(self, ttl=604800, interval=3600, batch_size=1000, vacuum_threshold=100000):
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_threshold = vacuum_threshold
+
+class ReconcileConfig:
+    def __init__(self, interval=3600, chunk_size=1000, batch_size=100, throttle=0.5, dry_run=False):
+        self.interval = interval  # Seconds between runs, 0 disables the job
+        self.chunk_size = chunk_size  # Users read per page from each side
+        self.batch_size = batch_size  # Corrections written per Galaxy transaction
+        self.throttle = throttle  # Seconds to pause between pages and between writes
+        self.dry_run = dry_run  # Only log the corrections
+
+class CacheConfig:
+    def __init__(self, size=10000, ttl=60, gzip=True, shared_ttl=2):
+        self.size = size
+        self.ttl = ttl
+        self.gzip = gzip  # Keep compressed response bodies too
+        self.shared_ttl = shared_ttl  # TTL cap with several server processes, which don't see each other's writes
+
+class LogConfig:
+    def __init__(self, level="INFO", format="text"):
+        self.level = level  # DEBUG, INFO, WARNING, ERROR, or OFF to disable logging
+        self.format = format  # text or json
 
 class AuthConfig: 
-    def __init__(self, api_key):
+    def __init__(self, api_key, api_keys=None):
         self.bearer_token = api_key
+        # Named keys, the ApiKey one is called default
+        self.api_keys = {"default": api_key} if api_key is not None else {}
+        self.api_keys.update(api_keys or {})
+
+class AdmissionConfig:
+    def __init__(self, rate_limit=0, rate_limit_burst=50, outbox_backlog_limit=0, outbox_backlog_retry_after=30,
+                 outbox_backlog_check_interval=1):
+        self.rate_limit = rate_limit  # Requests per second per API key, 0 disables the limit
+        self.rate_limit_burst = rate_limit_burst
+        self.outbox_backlog_limit = outbox_backlog_limit  # Pending rows before writes are refused, 0 disables it
+        self.outbox_backlog_retry_after = outbox_backlog_retry_after  # Seconds
+        self.outbox_backlog_check_interval = outbox_backlog_check_interval  # Seconds a backlog count is reused
 
 class ServerConfig: 
-    def __init__(self, host, port, request_body_limit):
+    def __init__(self, host, port, request_body_limit, bulk_chunk_size=100, workers=1, outbox_worker="embedded",
+                 shutdown_timeout=30, worker_metrics_port=0):
         self.host = host
         self.port = port
         self.request_body_limit = request_body_limit
+        self.bulk_chunk_size = bulk_chunk_size  # Pulsars written per bulk import transaction
+        self.workers = workers  # Server processes
+        self.outbox_worker = outbox_worker  # embedded or external, run by the worker command
+        self.shutdown_timeout = shutdown_timeout  # Seconds to finish in-flight requests and the outbox batch
+        self.worker_metrics_port = worker_metrics_port  # Metrics port of the worker command, 0 disables it
+
+def _parse_api_keys(value: str) -> dict:
+    # name=key pairs separated by commas
+    keys = {}
+    for entry in value.split(","):
+        if entry.strip():
+            name, _, key = entry.partition("=")
+            keys[name.strip()] = key.strip()
+    return keys
 
 def get_env_var(key: str):
     value = os.environ.get(key)
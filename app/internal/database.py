@@ -1,33 +1,102 @@
+import anyio
 from .config import AppConfig
-from sqlalchemy import create_engine
-from models.model import Base
+from sqlalchemy import create_engine, event, make_url
+from migrations import migrate
+from .metrics import instrument_engine
 from sqlalchemy.orm import Session
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import StaticPool, QueuePool
+
+def is_in_memory(url) -> bool:
+    """Whether url is a SQLite database private to the connection that opened it."""
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
 
 class Database:
     def __init__(self, config: AppConfig):
-        self.in_memory = config.database.in_memory
         self.path = config.database.path
         self.debug = config.database.debug
         self.engine = None
+        self.config = config.database
+        self.url = make_url(self._get_connection_string())
+        # Chosen from the URL, so sqlite:// in DatabaseUrl behaves like InMemory
+        self.in_memory = is_in_memory(self.url)
+        # Bounds the threads blocking on the database for request handlers,
+        # the in-memory database is a single shared connection
+        self.limiter = anyio.CapacityLimiter(1 if self.in_memory else config.database.threads)
 
     def _get_connection_string(self):
-        if self.in_memory:
+        if self.config.url:
+            return self.config.url
+        if self.config.in_memory:
             return f"sqlite://"
         else:
             return f"sqlite:///{self.path}"
 
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        # Transactions are begun by _begin_sqlite rather than by the driver,
+        # which only begins them at the first write
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={self.config.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={self.config.synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(self.config.busy_timeout)}")
+        cursor.execute(f"PRAGMA mmap_size={int(self.config.mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(self.config.cache_size)}")
+        cursor.close()
+
+    def _begin_sqlite(self, connection):
+        options = connection.get_execution_options()
+        if options.get("isolation_level") == "AUTOCOMMIT":
+            return
+        # A write transaction takes the write lock up front, a deferred one
+        # reading first could not write once another writer committed
+        connection.exec_driver_sql("BEGIN IMMEDIATE" if options.get("write") else "BEGIN")
+
     def connect(self):
-        self.engine =  create_engine(
-            self._get_connection_string(),
-            echo=self.debug,
-            poolclass=StaticPool,
-            connect_args={"check_same_thread": False}
-        )
-        Base.metadata.create_all(self.engine)
+        url = self.url
+        if self.in_memory:
+            self.engine = create_engine(
+                url,
+                echo=self.debug,
+                poolclass=StaticPool,
+                connect_args={"check_same_thread": False}
+            )
+        elif url.get_backend_name() == "sqlite":
+            # Each thread checks out its own connection, WAL lets readers
+            # proceed while the worker writes
+            self.engine = create_engine(
+                url,
+                echo=self.debug,
+                poolclass=QueuePool,
+                pool_size=self.config.pool_size,
+                max_overflow=self.config.max_overflow,
+                connect_args={"check_same_thread": False, "timeout": self.config.busy_timeout / 1000}
+            )
+            event.listen(self.engine, "connect", self._set_sqlite_pragmas)
+            event.listen(self.engine, "begin", self._begin_sqlite)
+        else:
+            self.engine = create_engine(
+                url,
+                echo=self.debug,
+                pool_size=self.config.pool_size,
+                max_overflow=self.config.max_overflow,
+                pool_recycle=self.config.pool_recycle,
+                pool_pre_ping=True,
+            )
+        instrument_engine(self.engine)
+        migrate(self.engine)
+        # Shares the pool, its transactions are write transactions on SQLite
+        self.write_engine = self.engine.execution_options(write=True)
         return self
 
-    def get_session(self) -> Session:
+    def get_session(self, write=False, **kwargs) -> Session:
+        """New session, pass write for sessions that read before they write."""
         if self.engine is None:
             raise Exception("Database not connected")
-        return Session(self.engine)
+        return Session(self.write_engine if write else self.engine, **kwargs)
+
+    async def run(self, fn, *args, write=False):
+        """Run fn(session, *args) with a new session on a worker thread."""
+        def work():
+            with self.get_session(write) as session:
+                return fn(session, *args)
+        return await anyio.to_thread.run_sync(work, limiter=self.limiter)
@@ -0,0 +1,44 @@
+import json
+import logging
+
+# Attributes every LogRecord has, anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+def _extra(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{key}={value}" for key, value in _extra(record).items())
+        return f"{line} {fields}" if fields else line
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(config):
+    """Configure the root logger, a level of OFF disables logging."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if config.level.upper() == "OFF":
+        root.addHandler(logging.NullHandler())
+        root.setLevel(logging.CRITICAL + 1)
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if config.format == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(config.level.upper())
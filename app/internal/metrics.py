@@ -0,0 +1,175 @@
+"""
+Minimal Prometheus-style metrics.
+
+Metrics live in a process-wide registry and are rendered in the
+Prometheus text exposition format by the metrics controller.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in labels)
+    return "{" + pairs + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "pulsar_registry_request_duration_seconds", "HTTP request latency by route"))
+REQUEST_DB_QUERIES = REGISTRY.register(Histogram(
+    "pulsar_registry_request_db_queries", "Database queries issued per HTTP request by route",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    "pulsar_registry_db_query_duration_seconds", "Registry database query latency"))
+OUTBOX_PENDING = REGISTRY.register(Gauge(
+    "pulsar_registry_outbox_pending", "Outbox rows waiting to be synced to Galaxy"))
+OUTBOX_DEAD = REGISTRY.register(Gauge(
+    "pulsar_registry_outbox_dead", "Dead-lettered outbox rows"))
+OUTBOX_OLDEST_AGE = REGISTRY.register(Gauge(
+    "pulsar_registry_outbox_oldest_pending_age_seconds", "Age of the oldest pending outbox row"))
+WORKER_SWEEP_DURATION = REGISTRY.register(Histogram(
+    "pulsar_registry_worker_sweep_duration_seconds", "Duration of one outbox worker sweep"))
+GALAXY_CALL_DURATION = REGISTRY.register(Histogram(
+    "pulsar_registry_galaxy_call_duration_seconds", "Galaxy database call latency by operation"))
+GALAXY_ERRORS = REGISTRY.register(Counter(
+    "pulsar_registry_galaxy_errors_total", "Failed Galaxy database calls by operation"))
+
+# Query counter of the HTTP request being served, copied into worker threads
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+def instrument_engine(engine):
+    """Time every query and count it against the current request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_DURATION.observe(time.perf_counter() - conn.info["query_start"].pop())
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and query count per route."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_queries.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start, method=scope["method"], route=path, status=status[0])
+            REQUEST_DB_QUERIES.observe(queries[0], method=scope["method"], route=path)
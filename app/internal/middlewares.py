@@ -1,23 +1,180 @@
-from fastapi import Depends
+import hmac
+import math
+import threading
+import time
+import anyio
+from fastapi import Depends, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, func
 from .config import AppConfig
+from .metrics import REGISTRY, Counter
 from fastapi import HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from models.model import Outbox
 
 security = HTTPBearer()
 
+REJECTED = REGISTRY.register(Counter(
+    "pulsar_registry_requests_rejected_total", "Requests refused by admission control by reason"))
+
+# Bodies of these routes are limited per item instead
+UNLIMITED_BODY_PATHS = {"/api/pulsar/bulk"}
+# Probes are never rate limited
+UNTHROTTLED_PATHS = {"/api/pulsar/health"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+def authenticate(api_keys: dict, token: str) -> str | None:
+    """Return the name of the key matching token, comparing every key in constant time."""
+    match = None
+    for name, key in api_keys.items():
+        if hmac.compare_digest(token.encode(), key.encode()):
+            match = name
+    return match
+
 def token_verification(config: AppConfig):
-    bearer_token = config.auth.bearer_token
-    
-    async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> None:
-        if bearer_token is None:
+    api_keys = config.auth.api_keys
+
+    async def verify_token(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> None:
+        if not api_keys:
             return None
-            
-        if credentials.credentials != bearer_token:
+        # The admission middleware already compared the token
+        name = request.scope.get("state", {}).get("api_key") or authenticate(api_keys, credentials.credentials)
+        if name is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         return None
-        
+
     return verify_token
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """Take a token, returning 0, or the seconds until one is available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+def _count_pending(session):
+    return session.execute(
+        select(func.count()).where(Outbox.deleted_at == None).where(Outbox.dead_at == None)).scalar()
+
+class AdmissionMiddleware:
+    """
+    Admit or refuse requests before they reach the routes.
+
+    Bodies over RequestBodyLimit are refused with a 413 from Content-Length
+    or while streaming, bearer tokens are matched in constant time against
+    the configured keys and each key is rate limited with a token bucket,
+    requests without a valid key sharing one bucket, and writes are refused
+    with a 503 while the outbox backlog is over its limit. Invalid tokens
+    are left to the routes' token dependency. The limits are split evenly
+    between the server processes.
+    """
+    def __init__(self, app, config: AppConfig):
+        self.app = app
+        self.body_limit = config.server.request_body_limit
+        self.api_keys = config.auth.api_keys
+        # Each server process gets its share of the limit
+        workers = max(1, config.server.workers)
+        self.rate_limit = config.admission.rate_limit / workers
+        self.burst = max(1, math.ceil(config.admission.rate_limit_burst / workers))
+        self.backlog_limit = config.admission.outbox_backlog_limit
+        self.retry_after = config.admission.outbox_backlog_retry_after
+        self.backlog_check_interval = config.admission.outbox_backlog_check_interval
+        self.buckets = {}
+        self.backlog = 0
+        self.backlog_checked_at = None
+        self.backlog_lock = anyio.Lock()
+
+    async def _reject(self, scope, receive, send, status_code, reason, detail, headers=None):
+        REJECTED.inc(reason=reason)
+        response = JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+        await response(scope, receive, send)
+
+    def _api_key(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    return authenticate(self.api_keys, token)
+        return None
+
+    def _content_length(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    async def _backlog(self, scope):
+        # Counted at most once per interval, concurrent requests share the result
+        async with self.backlog_lock:
+            now = time.monotonic()
+            if self.backlog_checked_at is None or now - self.backlog_checked_at >= self.backlog_check_interval:
+                self.backlog = await scope["app"].state.db.run(_count_pending)
+                self.backlog_checked_at = now
+            return self.backlog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        limit_body = scope["path"] not in UNLIMITED_BODY_PATHS
+        content_length = self._content_length(scope)
+        if limit_body and content_length is not None and content_length > self.body_limit:
+            return await self._reject(
+                scope, receive, send, 413, "body_size", "Request body exceeds the request body limit")
+
+        name = self._api_key(scope)
+        if name is not None:
+            scope.setdefault("state", {})["api_key"] = name
+        if self.rate_limit > 0 and scope["path"] not in UNTHROTTLED_PATHS:
+            # Requests without a valid key share the None bucket
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = self.buckets.setdefault(name, TokenBucket(self.rate_limit, self.burst))
+            wait = bucket.take()
+            if wait > 0:
+                return await self._reject(
+                    scope, receive, send, 429, "rate_limit", "Rate limit exceeded",
+                    {"Retry-After": str(math.ceil(wait))})
+
+        if self.backlog_limit > 0 and scope["method"] in WRITE_METHODS:
+            if await self._backlog(scope) > self.backlog_limit:
+                return await self._reject(
+                    scope, receive, send, 503, "outbox_backlog", "Outbox backlog is full, retry later",
+                    {"Retry-After": str(self.retry_after)})
+
+        if not limit_body:
+            return await self.app(scope, receive, send)
+
+        # Bodies without a Content-Length are counted as they arrive
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.body_limit:
+                    REJECTED.inc(reason="body_size")
+                    raise HTTPException(status_code=413, detail="Request body exceeds the request body limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import orjson
+from fastapi import Request, Response
+from models.queries import list_pulsars
+from .cache import ReadCache
+
+GZIP_MINIMUM_SIZE = 1000  # Same threshold as the GZipMiddleware
+STREAM_PAGE_SIZE = 1000  # Pulsars read per query while streaming
+
+class ResponseCache:
+    """
+    Pre-serialized pulsar JSON and compressed response bodies.
+
+    Each pulsar is encoded with orjson once per content, writers
+    invalidate it along with the read cache. Gzipped bodies are keyed by a
+    digest of their content so they can never be stale, and are only kept
+    when gzip is enabled.
+    """
+    def __init__(self, max_size=10000, ttl=60, gzip=True):
+        self.encoded = ReadCache(max_size, ttl)
+        self.compressed = ReadCache(max_size if gzip else 0, ttl)
+        self.gzip = gzip
+
+    def encode_pulsar(self, pulsar) -> bytes:
+        key = ("pulsar", pulsar["id"])
+        hit, entry, token = self.encoded.get(key)
+        # Compared by content, a recreated pulsar can reuse the id
+        if hit and entry[0] == pulsar:
+            return entry[1]
+        body = orjson.dumps(pulsar)
+        self.encoded.put(key, (pulsar, body), token)
+        return body
+
+    def encode_pulsars(self, pulsars) -> bytes:
+        return b"[" + b",".join(self.encode_pulsar(pulsar) for pulsar in pulsars) + b"]"
+
+    def invalidate(self, pulsar_id):
+        self.encoded.invalidate([("pulsar", pulsar_id)])
+
+    def _compress(self, body) -> bytes:
+        key = hashlib.sha1(body).digest()
+        hit, compressed, token = self.compressed.get(key)
+        if not hit:
+            compressed = gzip.compress(body, compresslevel=9)
+            self.compressed.put(key, compressed, token)
+        return compressed
+
+    def response(self, request: Request, body: bytes, headers=None) -> Response:
+        """JSON response for body, gzipped from the cache when the client accepts it."""
+        headers = dict(headers or {})
+        if self.gzip and len(body) >= GZIP_MINIMUM_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+            body = self._compress(body)
+            # Already encoded, the GZipMiddleware passes it through
+            headers["Content-Encoding"] = "gzip"
+            headers["Vary"] = "Accept-Encoding"
+        return Response(body, media_type="application/json", headers=headers)
+
+def invalidate_pulsar(request: Request, pulsar_id, emails):
+    """Drop the cached lookups and encoded body of a pulsar after a write."""
+    request.app.state.cache.invalidate(
+        [("pulsar", pulsar_id)] + [("user", email) for email in emails])
+    request.app.state.responses.invalidate(pulsar_id)
+
+async def stream_ndjson(db, user=None, after=None):
+    """Yield the pulsars, optionally shared with user, as NDJSON lines."""
+    # Page by page through db.run, the stream shares its limiter with the other requests
+    while True:
+        pulsars = await db.run(list_pulsars, user, after, STREAM_PAGE_SIZE)
+        for pulsar in pulsars:
+            yield orjson.dumps(pulsar) + b"\n"
+        if len(pulsars) < STREAM_PAGE_SIZE:
+            return
+        after = pulsars[-1]["id"]
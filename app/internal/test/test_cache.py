@@ -0,0 +1,47 @@
+from internal.cache import ReadCache
+from internal.config import AppConfig
+from main import create_app
+
+def test_get_or_load_counts_hits_and_misses():
+    cache = ReadCache(max_size=10, ttl=60)
+    loads = []
+    load = lambda: loads.append(1) or "value"
+
+    assert cache.get_or_load("key", load) == "value"
+    assert cache.get_or_load("key", load) == "value"
+    assert len(loads) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ReadCache(max_size=2, ttl=60)
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("b", lambda: 2)
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("c", lambda: 3)
+
+    assert cache.get_or_load("a", lambda: None) == 1
+    assert cache.get_or_load("b", lambda: None) is None
+    assert cache.stats()["evictions"] == 2
+
+def test_expired_entry_is_reloaded():
+    cache = ReadCache(max_size=10, ttl=0)
+    cache.get_or_load("key", lambda: "old")
+    assert cache.get_or_load("key", lambda: "new") == "new"
+
+def test_invalidate_during_load_does_not_store_stale_value():
+    cache = ReadCache(max_size=10, ttl=60)
+
+    def load():
+        cache.invalidate(["key"])
+        return "stale"
+
+    assert cache.get_or_load("key", load) == "stale"
+    assert cache.get_or_load("key", lambda: "fresh") == "fresh"
+
+def test_ttl_is_capped_with_several_processes():
+    config = AppConfig(test = True)
+    config.cache.ttl = 60
+    assert create_app(config).state.cache.ttl == 60
+    # Other processes' writes can't invalidate this process' cache
+    config.server.workers = 4
+    assert create_app(config).state.cache.ttl == config.cache.shared_ttl
@@ -0,0 +1,51 @@
+import threading
+import anyio
+from internal.config import AppConfig, to_absolute_path
+from internal.database import Database
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+def test_run_uses_a_worker_thread():
+    db = Database(AppConfig(test = True)).connect()
+
+    def work(session):
+        return threading.get_ident(), session.execute(text("SELECT 1")).scalar()
+
+    thread, value = anyio.run(db.run, work)
+    assert thread != threading.get_ident()
+    assert value == 1
+
+def test_file_database_uses_wal(tmp_path):
+    config = AppConfig(test = True)
+    config.database.in_memory = False
+    config.database.url = None
+    config.database.path = str(tmp_path / "registry.db")
+    db = Database(config).connect()
+
+    with db.get_session() as session:
+        assert session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert session.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert session.execute(text("PRAGMA busy_timeout")).scalar() == config.database.busy_timeout
+
+    # Concurrent sessions get their own pooled connection
+    with db.get_session() as reader, db.get_session() as writer:
+        assert reader.connection().connection.dbapi_connection is not writer.connection().connection.dbapi_connection
+
+def test_database_url_overrides_in_memory(tmp_path, monkeypatch):
+    with open(to_absolute_path("../../config.ini.sample")) as f:
+        sample = f.read()
+    assert "InMemory = true" in sample
+    url = f"sqlite:///{tmp_path / 'registry.db'}"
+    with open(tmp_path / "config.ini", "w") as f:
+        f.write(sample.replace("DatabaseUrl =", f"DatabaseUrl = {url}"))
+    monkeypatch.chdir(tmp_path)
+    config = AppConfig()
+    assert not config.database.in_memory
+    db = Database(config).connect()
+
+    assert not db.in_memory
+    assert isinstance(db.engine.pool, QueuePool)
+    assert db.limiter.total_tokens == config.database.threads
+    with db.get_session() as session:
+        assert session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert (tmp_path / "registry.db").exists()
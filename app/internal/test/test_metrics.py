@@ -0,0 +1,23 @@
+from internal.metrics import Registry, Counter, Histogram
+
+def test_render_histogram_and_counter():
+    registry = Registry()
+    histogram = registry.register(Histogram("latency_seconds", "Latency", buckets=(0.1, 1)))
+    counter = registry.register(Counter("errors_total", "Errors"))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    counter.inc(operation="sync")
+    counter.inc(operation="sync")
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 2',
+        'latency_seconds_sum{route="/a"} 0.55',
+        'latency_seconds_count{route="/a"} 2',
+        "# HELP errors_total Errors",
+        "# TYPE errors_total counter",
+        'errors_total{operation="sync"} 2.0',
+    ]
@@ -0,0 +1,86 @@
+import pytest
+from main import create_app
+from fastapi.testclient import TestClient
+from internal.config import AppConfig
+from internal.middlewares import TokenBucket, AdmissionMiddleware, authenticate
+from http import HTTPStatus
+from conftest import HEADERS
+
+PULSAR = {"url": "http://localhost:8080", "api_key": "1234567890", "users": ["test@test.com"]}
+
+def make_client(**admission):
+    config = AppConfig(test = True)
+    config.auth.api_keys["ci"] = "CI_KEY"
+    for name, value in admission.items():
+        setattr(config.admission, name, value)
+    return TestClient(create_app(config))
+
+def test_authenticate():
+    keys = {"default": "a-key", "ci": "b-key"}
+    assert authenticate(keys, "b-key") == "ci"
+    assert authenticate(keys, "c-key") is None
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 1
+
+def test_every_configured_key_is_accepted():
+    client = make_client()
+    assert client.post("/api/pulsar", json=PULSAR, headers={"Authorization": "Bearer CI_KEY"}).status_code == HTTPStatus.CREATED
+    assert client.get("/api/pulsar/1", headers={"Authorization": "Bearer WRONG"}).status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get("/api/pulsar/1").status_code == HTTPStatus.FORBIDDEN
+
+def test_oversized_bodies_are_rejected():
+    client = make_client()
+    body = {**PULSAR, "users": [f"user{i}@test.com" for i in range(500)]}
+    response = client.post("/api/pulsar", json=body, headers=HEADERS)
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+    # Streamed bodies have no Content-Length
+    chunks = iter([b'{"url": "http://localhost", "api_key": "key", "users": [', b'"a@test.com", ' * 400, b'"b@test.com"]}'])
+    response = client.post("/api/pulsar", content=chunks, headers={**HEADERS, "Content-Type": "application/json"})
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+    # The bulk import limits each item instead
+    response = client.post("/api/pulsar/bulk", json=[PULSAR] * 100, headers=HEADERS)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["created"] == 100
+
+def test_rate_limit_per_key():
+    client = make_client(rate_limit=0.001, rate_limit_burst=2)
+    for _ in range(2):
+        assert client.get("/api/pulsar", headers=HEADERS).status_code == HTTPStatus.OK
+    response = client.get("/api/pulsar", headers=HEADERS)
+    assert response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) > 0
+    # Other keys have their own bucket
+    assert client.get("/api/pulsar", headers={"Authorization": "Bearer CI_KEY"}).status_code == HTTPStatus.OK
+
+def test_requests_without_a_valid_key_share_a_bucket():
+    client = make_client(rate_limit=0.001, rate_limit_burst=2)
+    assert client.get("/api/pulsar", headers={"Authorization": "Bearer WRONG"}).status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get("/api/pulsar").status_code == HTTPStatus.FORBIDDEN
+    assert client.get("/api/pulsar", headers={"Authorization": "Bearer OTHER"}).status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert client.get("/api/pulsar/health").status_code == HTTPStatus.OK
+    assert client.get("/api/pulsar", headers=HEADERS).status_code == HTTPStatus.OK
+
+def test_rate_limit_is_split_between_server_processes():
+    config = AppConfig(test = True)
+    config.server.workers = 4
+    config.admission.rate_limit = 8
+    config.admission.rate_limit_burst = 50
+    middleware = AdmissionMiddleware(None, config)
+    assert (middleware.rate_limit, middleware.burst) == (2, 13)
+
+def test_writes_are_refused_while_the_outbox_backlog_is_full():
+    client = make_client(outbox_backlog_limit=1, outbox_backlog_retry_after=10, outbox_backlog_check_interval=0)
+    assert client.post("/api/pulsar", json=PULSAR, headers=HEADERS).status_code == HTTPStatus.CREATED
+    body = {**PULSAR, "users": ["a@test.com", "b@test.com"]}
+    assert client.post("/api/pulsar", json=body, headers=HEADERS).status_code == HTTPStatus.CREATED
+    response = client.put("/api/pulsar/1", json=PULSAR, headers=HEADERS)
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "10"
+    # Reads are still served
+    assert client.get("/api/pulsar/1", headers=HEADERS).status_code == HTTPStatus.OK
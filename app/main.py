@@ -3,47 +3,144 @@ from fastapi.middleware.gzip import GZipMiddleware
 from internal.database import Database
 from controllers.pulsar_controller import router as pulsar_router
 from controllers.health_controller import router as health_router
+from controllers.outbox_controller import router as outbox_router
+from controllers.cache_controller import router as cache_router
+from controllers.bulk_controller import router as bulk_router
+from controllers.metrics_controller import router as metrics_router
 from internal.config import AppConfig
-from internal.middlewares import token_verification as token_verification
-from worker.worker import Worker
+from internal.cache import ReadCache
+from internal.responses import ResponseCache
+from internal.metrics import MetricsMiddleware
+from internal.log import configure_logging
+from internal.middlewares import token_verification as token_verification, AdmissionMiddleware
+from worker.supervisor import Supervisor
 from galaxy.galaxy import Galaxy
+from contextlib import asynccontextmanager
+import anyio
+import argparse
+import signal
+import sys
+import threading
+import logging
 import uvicorn
 
-def create_app(config: AppConfig) -> FastAPI:
-    app = FastAPI(docs_url="/api/pulsar/docs")
+logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = app.state.config
+    # Server processes spawned by uvicorn start with logging unconfigured
+    configure_logging(config.log)
+    supervisor = None
+    if config.server.outbox_worker == "embedded":
+        # Every server process competes, one runs the jobs
+        supervisor = Supervisor(app, Galaxy, config)
+        supervisor.start()
+    yield
+    # Uvicorn has finished the in-flight requests, let the worker commit its batch
+    if supervisor is not None:
+        await anyio.to_thread.run_sync(supervisor.stop, config.server.shutdown_timeout)
+    app.state.db.engine.dispose()
+
+def create_app(config: AppConfig | None = None) -> FastAPI:
+    """Build the application, reading the configuration when none is given."""
+    config = config or AppConfig()
+    app = FastAPI(docs_url="/api/pulsar/docs", lifespan=lifespan)
+
+    app.state.config = config
     database = Database(config)
     app.state.db = database.connect()
+    app.state.outbox_event = threading.Event()
+    cache_ttl = config.cache.ttl
+    if config.server.workers > 1:
+        # Writes only invalidate the cache of the process serving them
+        cache_ttl = min(cache_ttl, config.cache.shared_ttl)
+    app.state.cache = ReadCache(config.cache.size, cache_ttl)
+    app.state.responses = ResponseCache(config.cache.size, config.cache.ttl, config.cache.gzip)
 
+    app.add_middleware(AdmissionMiddleware, config=config)
     app.add_middleware(GZipMiddleware, minimum_size=1000)
+    # Outermost, so latency includes compression
+    app.add_middleware(MetricsMiddleware)
 
     verify_token = token_verification(config)
     app.include_router(health_router)
+    # Before the pulsar routes, /api/pulsar/{id} would shadow /api/pulsar/export
+    app.include_router(bulk_router, dependencies=[Depends(verify_token)])
+    app.include_router(metrics_router, dependencies=[Depends(verify_token)])
     app.include_router(pulsar_router, dependencies=[Depends(verify_token)])
+    app.include_router(outbox_router, dependencies=[Depends(verify_token)])
+    app.include_router(cache_router, dependencies=[Depends(verify_token)])
 
     return app
 
-config = AppConfig()
-app = create_app(config)
+def create_metrics_app(app: FastAPI) -> FastAPI:
+    """Serve only the metrics route, for a worker process running the jobs of app."""
+    config = app.state.config
+    metrics_app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    metrics_app.state.config = config
+    metrics_app.state.db = app.state.db
+    metrics_app.include_router(metrics_router, dependencies=[Depends(token_verification(config))])
+    return metrics_app
+
+def _shared_database(config: AppConfig) -> bool:
+    # An in-memory database only exists inside the process that created it
+    return not Database(config).in_memory
 
-def main():
-    galaxy = Galaxy(config)
-    worker = Worker(app, galaxy)
-    worker.start()
+def serve(config: AppConfig):
+    if config.server.workers > 1 and not _shared_database(config):
+        sys.exit("Workers > 1 needs a database on disk, an in-memory database can't be shared between processes")
+    if _shared_database(config):
+        # Migrate before the server processes start, their own migrate waits on a lock and finds nothing to do
+        Database(config).connect().engine.dispose()
 
     addr = f"{config.server.host}:{config.server.port}"
-    print(f"Listening on http://{addr}")
-    try:
-        uvicorn.run(
-            "main:app",
-            log_level="info",
-            host=config.server.host,
-            port=config.server.port,
-        )
-    except:
-        worker.stop()
-        worker.join()
-        raise 
+    logger.info(f"Listening on http://{addr}", extra={"workers": config.server.workers})
+    uvicorn.run(
+        "main:create_app",
+        factory=True,
+        workers=config.server.workers,
+        log_config=None,  # Keep the handlers set up by configure_logging
+        host=config.server.host,
+        port=config.server.port,
+        timeout_graceful_shutdown=config.server.shutdown_timeout,
+    )
+
+def run_worker(config: AppConfig):
+    if not _shared_database(config):
+        sys.exit("The worker needs a database on disk shared with the server")
+    app = create_app(config)
+    supervisor = Supervisor(app, Galaxy, config)
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+    supervisor.start()
+    metrics_server = None
+    if config.server.worker_metrics_port:
+        # The server processes don't see the worker and Galaxy metrics of this process
+        metrics_server = uvicorn.Server(uvicorn.Config(
+            create_metrics_app(app), host=config.server.host, port=config.server.worker_metrics_port,
+            log_config=None))
+        threading.Thread(target=metrics_server.run, name="metrics", daemon=True).start()
+    stopping.wait()
+    logger.info("Stopping the outbox worker")
+    if metrics_server is not None:
+        metrics_server.should_exit = True
+    supervisor.stop(config.server.shutdown_timeout)
+    app.state.db.engine.dispose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python main.py", description="Pulsar registry")
+    parser.add_argument("command", nargs="?", choices=["serve", "worker"], default="serve",
+                        help="serve the API (default), or only run the outbox worker")
+    args = parser.parse_args(argv)
+
+    config = AppConfig()
+    configure_logging(config.log)
+    if args.command == "worker":
+        run_worker(config)
+    else:
+        serve(config)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+"""
+Versioned schema migrations.
+
+Each migration module exposes upgrade(connection). Applied versions are
+recorded in the schema_version table, and migrate runs the pending ones
+in order inside a single transaction.
+"""
+import fcntl
+import logging
+from contextlib import contextmanager
+from sqlalchemy import Table, Column, Integer, MetaData, select, insert, text
+from . import v001_initial, v002_outbox_delivery, v003_outbox_created_at
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    (1, v001_initial),
+    (2, v002_outbox_delivery),
+    (3, v003_outbox_created_at),
+]
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+)
+
+def current_version(connection):
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+@contextmanager
+def _file_lock(engine):
+    # SQLite has no advisory locks, serialize processes sharing a database file
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or database in (None, "", ":memory:"):
+        yield
+        return
+    with open(f"{database}.migrate.lock", "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+def migrate(engine):
+    with _file_lock(engine), engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Serialize replicas starting at the same time
+            connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('pulsar_registry_migrations'))"))
+        version = current_version(connection)
+        for target, migration in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("Applying migration %s: %s", target, migration.__name__)
+            migration.upgrade(connection)
+            connection.execute(insert(schema_version).values(version=target))
+    return engine
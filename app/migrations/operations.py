@@ -0,0 +1,11 @@
+from sqlalchemy import text, inspect
+
+def add_column(connection, table_name, column):
+    # Databases created before migrations existed may already have it
+    existing = {c["name"] for c in inspect(connection).get_columns(table_name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=connection.dialect)
+    nullable = "" if column.nullable else " NOT NULL"
+    default = "" if column.server_default is None else f" DEFAULT {column.server_default.arg}"
+    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}{default}{nullable}"))
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.pool import StaticPool
+from migrations import migrate, schema_version, MIGRATIONS, v001_initial
+from models.model import Base
+
+def sqlite_engine():
+    return create_engine("sqlite://", poolclass=StaticPool)
+
+def test_migrations_match_models():
+    engine = migrate(sqlite_engine())
+    inspector = inspect(engine)
+    for table in Base.metadata.tables.values():
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == set(table.columns.keys()), table.name
+    indexes = {index["name"] for index in inspector.get_indexes("outbox")}
+    assert "ix_outbox_pending" in indexes
+
+def test_migrate_is_idempotent():
+    engine = migrate(migrate(sqlite_engine()))
+    with engine.connect() as connection:
+        versions = connection.execute(select(schema_version.c.version)).scalars().all()
+    assert versions == [version for version, _ in MIGRATIONS]
+
+def test_migrate_upgrades_databases_created_before_migrations():
+    engine = sqlite_engine()
+    v001_initial.metadata.create_all(engine)
+    migrate(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns("outbox")}
+    assert {"claimed_by", "attempts", "dead_at"} <= columns
+
+def test_concurrent_migrations_of_a_file_database(tmp_path):
+    # As server processes starting together, each with its own engine
+    url = f"sqlite:///{tmp_path / 'registry.db'}"
+    engines = [create_engine(url) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(migrate, engines))
+    with engines[0].connect() as connection:
+        versions = connection.execute(select(schema_version.c.version)).scalars().all()
+    assert versions == [version for version, _ in MIGRATIONS]
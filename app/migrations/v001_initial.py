@@ -0,0 +1,39 @@
+"""Schema as first released, created with Base.metadata.create_all."""
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, Enum, ForeignKey
+
+metadata = MetaData()
+
+Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("email", String(255), unique=True),
+)
+
+Table(
+    "pulsars",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("url", String(255)),
+    Column("api_key", String(255)),
+)
+
+Table(
+    "pulsar_user",
+    metadata,
+    Column("pulsar_id", ForeignKey("pulsars.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+)
+
+Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("message", Enum("CREATED", "UPDATED", "DELETED", name="message")),
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE")),
+    Column("pulsar_id", ForeignKey("pulsars.id", ondelete="CASCADE")),
+    Column("deleted_at", DateTime, nullable=True),
+)
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,19 @@
+"""Outbox leases, retries and dead letters."""
+from sqlalchemy import Column, Integer, String, DateTime, Text, text, inspect
+from .operations import add_column
+
+def upgrade(connection):
+    add_column(connection, "outbox", Column("claimed_by", String(255), nullable=True))
+    add_column(connection, "outbox", Column("lease_expires_at", DateTime, nullable=True))
+    add_column(connection, "outbox", Column("attempts", Integer, nullable=False, server_default="0"))
+    add_column(connection, "outbox", Column("next_attempt_at", DateTime, nullable=True))
+    add_column(connection, "outbox", Column("last_error", Text, nullable=True))
+    add_column(connection, "outbox", Column("dead_at", DateTime, nullable=True))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_pending ON outbox (id, user_id) WHERE deleted_at IS NULL"))
+
+    # DELETED messages outlive their pulsar, only SQLite leaves the foreign key unenforced
+    if connection.dialect.name != "sqlite":
+        for foreign_key in inspect(connection).get_foreign_keys("outbox"):
+            if foreign_key["constrained_columns"] == ["pulsar_id"]:
+                connection.execute(text(f"ALTER TABLE outbox DROP CONSTRAINT {foreign_key['name']}"))
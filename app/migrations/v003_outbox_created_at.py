@@ -0,0 +1,7 @@
+"""Outbox row creation time, for the backlog age metric."""
+from sqlalchemy import Column, DateTime
+from .operations import add_column
+
+def upgrade(connection):
+    # Nullable, rows written before this migration have no creation time
+    add_column(connection, "outbox", Column("created_at", DateTime, nullable=True))
@@ -1,6 +1,7 @@
 from typing import List
+import datetime
 import enum
-from sqlalchemy import ForeignKey, String, Table, Column, Enum, DateTime, func
+from sqlalchemy import ForeignKey, String, Table, Column, Enum, DateTime, Integer, Text, Index, func, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, declared_attr
 
 class Base(DeclarativeBase):
@@ -22,7 +23,6 @@ class User(Base):
     pulsars: Mapped[List["Pulsar"]] = relationship(
         secondary=pulsar_user,
         back_populates="users",
-        cascade="all, delete",
     )
 
     def __repr__(self):
@@ -36,7 +36,6 @@ class Pulsar(Base):
     users: Mapped[List[User]] = relationship(
         secondary=pulsar_user,
         back_populates="pulsars",
-        cascade="all, delete",
     )
 
     def __repr__(self):
@@ -52,9 +51,27 @@ class Outbox(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     message: Mapped[Message] = mapped_column(Enum(Message))
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    pulsar_id: Mapped[int] = mapped_column(ForeignKey("pulsars.id", ondelete="CASCADE"))
+    # Not a foreign key, DELETED messages outlive their pulsar
+    pulsar_id: Mapped[int] = mapped_column(Integer)
     deleted_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, default=None)
+    claimed_by: Mapped[str] = mapped_column(String(255), nullable=True, default=None)
+    lease_expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, default=None)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    next_attempt_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, default=None)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True, default=None)
+    dead_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, default=None)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, default=datetime.datetime.now)
 
+    __table_args__ = (
+        # Pending rows are a small slice of the table, index only those
+        Index(
+            "ix_outbox_pending",
+            "id",
+            "user_id",
+            sqlite_where=text("deleted_at IS NULL"),
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
 
     def __repr__(self):
         return f"<Outbox {self.message}>"
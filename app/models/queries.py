@@ -0,0 +1,134 @@
+from sqlalchemy import select, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from models.model import User, Outbox, Pulsar, pulsar_user
+
+def _insert_ignore(session, table, index_elements):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return insert(table)
+
+def get_or_create_users(session, emails):
+    """
+    Return the users for the given emails in order, creating missing ones.
+
+    Existing users are fetched with one IN query and missing ones inserted
+    with one multi-row INSERT that ignores concurrent inserts of the same
+    email.
+    """
+    emails = list(dict.fromkeys(emails))
+    if not emails:
+        return []
+    result = session.execute(select(User).where(User.email.in_(emails)))
+    users = {user.email: user for user in result.scalars()}
+    missing = [email for email in emails if email not in users]
+    if missing:
+        statement = _insert_ignore(session, User, ["email"])
+        rows = [{"email": email} for email in missing]
+        if session.get_bind().dialect.insert_returning:
+            # RETURNING hands back the new users, only concurrent inserts need a lookup
+            inserted = session.scalars(statement.returning(User), rows).all()
+            users.update({user.email: user for user in inserted})
+            missing = [email for email in missing if email not in users]
+        else:
+            session.execute(statement, rows)
+        if missing:
+            result = session.execute(select(User).where(User.email.in_(missing)))
+            users.update({user.email: user for user in result.scalars()})
+    return [users[email] for email in emails]
+
+def add_outbox_messages(session, message, pulsar_id, user_ids):
+    user_ids = list(dict.fromkeys(user_ids))
+    if user_ids:
+        session.execute(
+            insert(Outbox),
+            [{"message": message, "user_id": user_id, "pulsar_id": pulsar_id} for user_id in user_ids],
+        )
+
+def _select_pulsars(*conditions):
+    return (
+        select(Pulsar.id, Pulsar.url, Pulsar.api_key, User.email)
+        .outerjoin(pulsar_user, pulsar_user.c.pulsar_id == Pulsar.id)
+        .outerjoin(User, User.id == pulsar_user.c.user_id)
+        .where(*conditions)
+        .order_by(Pulsar.id, User.id)
+    )
+
+def _iter_pulsars(rows):
+    # Rows are ordered by pulsar, fold each pulsar's emails into one dict
+    pulsar = None
+    for id, url, api_key, email in rows:
+        if pulsar is None or pulsar["id"] != id:
+            if pulsar is not None:
+                yield pulsar
+            pulsar = {"id": id, "url": url, "api_key": api_key, "users": []}
+        if email is not None:
+            pulsar["users"].append(email)
+    if pulsar is not None:
+        yield pulsar
+
+def _page_ids(user=None, after=None, limit=None):
+    ids = select(Pulsar.id).order_by(Pulsar.id)
+    if user is not None:
+        shared = (
+            select(pulsar_user.c.pulsar_id)
+            .join(User, User.id == pulsar_user.c.user_id)
+            .where(User.email == user)
+        )
+        ids = ids.where(Pulsar.id.in_(shared))
+    if after is not None:
+        ids = ids.where(Pulsar.id > after)
+    if limit is not None:
+        ids = ids.limit(limit)
+    return ids
+
+def find_pulsar(session, pulsar_id):
+    """Return the pulsar as a plain dict, or None, in a single query."""
+    return next(_iter_pulsars(session.execute(_select_pulsars(Pulsar.id == pulsar_id))), None)
+
+def list_pulsars(session, user=None, after=None, limit=None):
+    """
+    Return one keyset page of pulsars, optionally shared with user, as
+    plain dicts in a single query. Pulsars are ordered by id and start
+    after the id given as after.
+    """
+    query = _select_pulsars(Pulsar.id.in_(_page_ids(user, after, limit)))
+    return list(_iter_pulsars(session.execute(query)))
+
+def _byte_order(column, dialect):
+    # Compare strings by code point on every backend, like Python and Galaxy's COLLATE "C"
+    return column.collate("C") if dialect == "postgresql" else column
+
+def _user_pulsars(session, email, users):
+    rows = session.execute(
+        select(User.email, Pulsar.id, Pulsar.url, Pulsar.api_key)
+        .outerjoin(pulsar_user, pulsar_user.c.user_id == User.id)
+        .outerjoin(Pulsar, Pulsar.id == pulsar_user.c.pulsar_id)
+        .where(User.id.in_(users))
+        .order_by(email, Pulsar.id)
+    )
+    result = []
+    for user_email, id, url, api_key in rows:
+        if not result or result[-1][0] != user_email:
+            result.append((user_email, []))
+        if id is not None:
+            result[-1][1].append({"id": id, "url": url, "api_key": api_key})
+    return result
+
+def list_user_pulsars(session, after=None, limit=1000):
+    """
+    Return the next limit users after the given email, in code point
+    order, as (email, pulsars) pairs. Pulsars are dicts ordered by id.
+    """
+    email = _byte_order(User.email, session.get_bind().dialect.name)
+    users = select(User.id).order_by(email).limit(limit)
+    if after is not None:
+        users = users.where(email > after)
+    return _user_pulsars(session, email, users)
+
+def find_user_pulsars(session, emails):
+    """Like list_user_pulsars, for the given emails."""
+    email = _byte_order(User.email, session.get_bind().dialect.name)
+    return _user_pulsars(session, email, select(User.id).where(User.email.in_(emails)))
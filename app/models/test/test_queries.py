@@ -0,0 +1,33 @@
+from models import queries
+from models.queries import get_or_create_users
+from models.model import User
+from sqlalchemy import select, insert, event
+
+def test_get_or_create_users_dedups_in_order(app):
+    statements = []
+    event.listen(app.state.db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with app.state.db.get_session() as session:
+        users = get_or_create_users(session, ["b@test.com", "a@test.com", "b@test.com"])
+        assert [user.email for user in users] == ["b@test.com", "a@test.com"]
+        # One lookup and one multi-row insert
+        assert len(statements) == 2
+
+        users = get_or_create_users(session, ["a@test.com", "c@test.com"])
+        assert [user.email for user in users] == ["a@test.com", "c@test.com"]
+        assert session.execute(select(User.email).order_by(User.email)).scalars().all() == [
+            "a@test.com", "b@test.com", "c@test.com"]
+
+def test_get_or_create_users_finds_concurrent_inserts(app, monkeypatch):
+    insert_ignore = queries._insert_ignore
+
+    def racing_insert_ignore(session, table, index_elements):
+        # Another writer inserts the user between the lookup and the insert
+        session.execute(insert(User).values(email="a@test.com"))
+        return insert_ignore(session, table, index_elements)
+
+    monkeypatch.setattr(queries, "_insert_ignore", racing_insert_ignore)
+    with app.state.db.get_session() as session:
+        users = get_or_create_users(session, ["a@test.com", "b@test.com"])
+        assert [user.email for user in users] == ["a@test.com", "b@test.com"]
+        assert all(user.id is not None for user in users)
+        assert len(session.execute(select(User)).scalars().all()) == 2
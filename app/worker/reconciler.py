@@ -0,0 +1,160 @@
+import threading
+import logging
+import time
+from collections import namedtuple
+from models.queries import list_user_pulsars, find_user_pulsars
+from internal.config import ReconcileConfig
+from galaxy.galaxy import PULSAR_HOST, PULSAR_API_KEY
+
+logger = logging.getLogger(__name__)
+
+# What Galaxy.sync_batch reads from users and pulsars
+_User = namedtuple("_User", ["email"])
+_Pulsar = namedtuple("_Pulsar", ["url", "api_key"])
+
+ABSENT = object()  # Key missing from one side of the join
+
+class ReconcileReport:
+    def __init__(self, checked=0, drifted=0, corrected=0, missing=0, failed=0, unmanaged=0, duration=0.0,
+                 dry_run=False):
+        self.checked = checked  # Registry users compared
+        self.drifted = drifted  # Users whose Galaxy preference differs
+        self.corrected = corrected
+        self.missing = missing  # Drifted users without a galaxy_user
+        self.failed = failed
+        self.unmanaged = unmanaged  # Galaxy users with pulsar keys unknown to the registry, left alone
+        self.duration = duration
+        self.dry_run = dry_run
+
+    def __repr__(self):
+        return (f"<ReconcileReport checked={self.checked} drifted={self.drifted} corrected={self.corrected} "
+                f"missing={self.missing} failed={self.failed} unmanaged={self.unmanaged} "
+                f"duration={self.duration:.3f}s dry_run={self.dry_run}>")
+
+def merge_join(left, right):
+    """
+    Full outer join of two iterables of (key, value) pairs sorted by key.
+    Yields (key, left value, right value), with ABSENT for a missing side.
+    """
+    left, right = iter(left), iter(right)
+    l, r = next(left, None), next(right, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield l[0], l[1], ABSENT
+            l = next(left, None)
+        elif l is None or r[0] < l[0]:
+            yield r[0], ABSENT, r[1]
+            r = next(right, None)
+        else:
+            yield l[0], l[1], r[1]
+            l, r = next(left, None), next(right, None)
+
+def in_sync(pulsars, preference):
+    """
+    Whether a Galaxy preference matches the user's pulsars. Any of the
+    user's pulsars is accepted, the worker sends the most recently written
+    one; a user without pulsars must have no pulsar keys.
+    """
+    if preference is None:
+        return False  # Not valid JSON
+    current = (preference.get(PULSAR_HOST), preference.get(PULSAR_API_KEY))
+    if not pulsars:
+        return current == (None, None)
+    return any((pulsar["url"], pulsar["api_key"]) == current for pulsar in pulsars)
+
+def _desired(pulsars):
+    # The most recent pulsar, like the worker when the task's pulsar is gone
+    if not pulsars:
+        return None
+    return _Pulsar(pulsars[-1]["url"], pulsars[-1]["api_key"])
+
+class Reconciler(threading.Thread):
+    """
+    Repair Galaxy preferences that drifted from the registry.
+
+    The registry's users and Galaxy's extra_user_preferences rows are read
+    in pages sorted by email and merge-joined, so neither side is loaded
+    fully into memory. Only drifted users are written, in small batches,
+    pausing between pages and writes to keep the load on both databases low.
+    """
+    def __init__(self, app, galaxy, config=None):
+        super().__init__(daemon=True)  # Daemon thread will exit when the main thread does
+        config = config or ReconcileConfig()
+        self.app = app
+        self.galaxy = galaxy
+        self.stop_event = threading.Event()  # Event to signal when to stop
+        self.interval = config.interval  # Time between runs
+        self.chunk_size = config.chunk_size  # Users read per page
+        self.batch_size = config.batch_size  # Corrections per Galaxy transaction
+        self.throttle = config.throttle  # Pause between pages and writes
+        self.dry_run = config.dry_run  # Log the corrections without writing them
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):  # Keep running until stop_event is set
+            try:
+                report = self.reconcile()
+                logger.info("Galaxy reconciliation", extra=vars(report))
+            except Exception:
+                logger.exception("Failed to reconcile Galaxy")
+
+    def _pages(self, fetch):
+        # Yield from fetch(after, limit) page by page until a short page
+        after = None
+        while not self.stop_event.is_set():
+            page = fetch(after, self.chunk_size)
+            yield from page
+            if len(page) < self.chunk_size:
+                return
+            after = page[-1][0]
+            self.stop_event.wait(self.throttle)
+
+    def _registry_page(self, after, limit):
+        with self.app.state.db.get_session() as session:
+            return list_user_pulsars(session, after, limit)
+
+    def reconcile(self, dry_run=None):
+        dry_run = self.dry_run if dry_run is None else dry_run
+        start = time.monotonic()
+        report = ReconcileReport(dry_run=dry_run)
+        drifted = []
+        rows = merge_join(self._pages(self._registry_page), self._pages(self.galaxy.get_preferences))
+        for email, pulsars, preference in rows:
+            # A side cut short by stop would look like drift
+            if self.stop_event.is_set():
+                break
+            if pulsars is ABSENT:
+                if preference is None or PULSAR_HOST in preference or PULSAR_API_KEY in preference:
+                    report.unmanaged += 1
+                continue
+            report.checked += 1
+            if in_sync(pulsars, {} if preference is ABSENT else preference):
+                continue
+            report.drifted += 1
+            logger.info("Galaxy preference drifted", extra={"email": email, "dry_run": dry_run})
+            if not dry_run:
+                drifted.append(email)
+                if len(drifted) >= self.batch_size:
+                    self._correct(drifted, report)
+                    drifted = []
+        if drifted and not self.stop_event.is_set():
+            self._correct(drifted, report)
+        report.duration = time.monotonic() - start
+        return report
+
+    def _correct(self, emails, report):
+        # Reread the registry so a write racing the scan is not undone
+        with self.app.state.db.get_session() as session:
+            users = find_user_pulsars(session, emails)
+        changes = [(_User(email), _desired(pulsars)) for email, pulsars in users]
+        try:
+            missing = self.galaxy.sync_batch(changes)
+        except Exception:
+            logger.exception("Failed to correct Galaxy preferences", extra={"users": len(changes)})
+            report.failed += len(changes)
+        else:
+            report.missing += len(missing)
+            report.corrected += len(changes) - len(missing)
+        self.stop_event.wait(self.throttle)
+
+    def stop(self):
+        self.stop_event.set()  # Signal to stop
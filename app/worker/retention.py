@@ -0,0 +1,93 @@
+import threading
+import logging
+import datetime
+import time
+from sqlalchemy import select, delete, text
+from models.model import Outbox
+from internal.config import RetentionConfig
+
+logger = logging.getLogger(__name__)
+
+class RetentionReport:
+    def __init__(self, purged, duration, vacuumed):
+        self.purged = purged
+        self.duration = duration
+        self.vacuumed = vacuumed
+
+    def __repr__(self):
+        return f"<RetentionReport purged={self.purged} duration={self.duration:.3f}s vacuumed={self.vacuumed}>"
+
+class Retention(threading.Thread):
+    """
+    Purge completed outbox rows older than the configured TTL.
+
+    Rows are deleted in small transactions so the database write lock is
+    only held briefly, and the table is vacuumed once enough rows have been
+    purged since the last vacuum.
+    """
+    def __init__(self, app, config=None):
+        super().__init__(daemon=True)  # Daemon thread will exit when the main thread does
+        config = config or RetentionConfig()
+        self.app = app
+        self.stop_event = threading.Event()  # Event to signal when to stop
+        self.ttl = datetime.timedelta(seconds=config.ttl)  # Age of completed rows before they are purged
+        self.interval = config.interval  # Time between purges
+        self.batch_size = config.batch_size  # Rows deleted per transaction
+        self.vacuum_threshold = config.vacuum_threshold  # Rows purged before vacuuming
+        self.purged_since_vacuum = 0
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):  # Keep running until stop_event is set
+            try:
+                report = self.purge()
+                logger.info(
+                    "Outbox retention",
+                    extra={"purged": report.purged, "duration": round(report.duration, 3), "vacuumed": report.vacuumed})
+            except Exception:
+                logger.exception("Failed to purge outbox")
+
+    def purge(self):
+        start = time.monotonic()
+        cutoff = datetime.datetime.now() - self.ttl
+        purged = 0
+        while not self.stop_event.is_set():
+            deleted = self._delete_batch(cutoff)
+            purged += deleted
+            if deleted < self.batch_size:
+                break
+        self.purged_since_vacuum += purged
+        vacuumed = self.purged_since_vacuum >= self.vacuum_threshold
+        if vacuumed:
+            self._vacuum()
+            self.purged_since_vacuum = 0
+        return RetentionReport(purged, time.monotonic() - start, vacuumed)
+
+    def _delete_batch(self, cutoff):
+        with self.app.state.db.get_session() as session:
+            batch = (
+                select(Outbox.id)
+                .where(Outbox.deleted_at < cutoff)
+                .order_by(Outbox.id)
+                .limit(self.batch_size)
+            )
+            result = session.execute(
+                delete(Outbox)
+                .where(Outbox.id.in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return result.rowcount
+
+    def _vacuum(self):
+        engine = self.app.state.db.engine
+        if engine.dialect.name == "sqlite":
+            statements = ["VACUUM", "ANALYZE outbox"]
+        else:
+            statements = [f"VACUUM ANALYZE {Outbox.__tablename__}"]
+        # VACUUM cannot run inside a transaction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    def stop(self):
+        self.stop_event.set()  # Signal to stop
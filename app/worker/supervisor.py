@@ -0,0 +1,178 @@
+import fcntl
+import threading
+import logging
+import os
+from sqlalchemy import text
+from internal.database import is_in_memory
+from worker.worker import Worker
+from worker.retention import Retention
+from worker.reconciler import Reconciler
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "pulsar_registry_outbox_worker"
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        file = open(self.path, "a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
+
+    def held(self):
+        return self.file is not None  # A flock lasts as long as the file is open
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()  # Closing the file releases the lock
+            self.file = None
+
+class _AdvisoryLock:
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+
+    def acquire(self):
+        # Held for as long as this connection stays open
+        connection = self.engine.connect()
+        if connection.execute(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": LOCK_NAME}).scalar():
+            connection.commit()
+            self.connection = connection
+            return True
+        connection.close()
+        return False
+
+    def held(self):
+        # The lock goes away with the session when the connection drops,
+        # this connection takes no other advisory lock
+        try:
+            held = self.connection.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() AND granted)"
+            )).scalar()
+            self.connection.rollback()
+            return held
+        except Exception:
+            logger.exception("Failed to check the leader lock")
+            return False
+
+    def release(self):
+        if self.connection is not None:
+            self.connection.invalidate()  # Closing the session releases the lock
+            self.connection = None
+
+class _ProcessLock:
+    # A private in-memory database is only ever used by one process
+    def acquire(self):
+        return True
+
+    def held(self):
+        return True
+
+    def release(self):
+        pass
+
+def leader_lock(db):
+    """Lock held by the one process running the background jobs of a database."""
+    url = db.engine.url
+    if url.get_backend_name() == "postgresql":
+        return _AdvisoryLock(db.engine)
+    if is_in_memory(url):
+        return _ProcessLock()
+    return _FileLock(f"{url.database}.worker.lock")
+
+class Supervisor(threading.Thread):
+    """
+    Run the outbox worker, retention and reconciliation of one registry.
+
+    Every process may start a supervisor, only the one holding the leader
+    lock runs the jobs while the others wait to take over. The leader keeps
+    checking its lock and its jobs, restarting jobs that died and stepping
+    down if the lock was lost. Stopping lets the worker finish and commit
+    its current batch before returning.
+    """
+    def __init__(self, app, galaxy_factory, config, election_interval=5):
+        super().__init__(daemon=True)  # Daemon thread will exit when the main thread does
+        self.app = app
+        self.galaxy_factory = galaxy_factory  # Builds the Galaxy client once elected
+        self.config = config
+        self.election_interval = election_interval  # Time between checks of the lock and the jobs
+        self.stop_event = threading.Event()  # Event to signal when to stop
+        self.lock = leader_lock(app.state.db)
+        self.factories = []
+        self.jobs = []
+        self.galaxy = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if not self.jobs:
+                    self._elect()
+                elif not self.lock.held():
+                    logger.error("Lost the leader lock, stopping the outbox worker", extra={"pid": os.getpid()})
+                    self._step_down()
+                else:
+                    self._restart_dead_jobs()
+            except Exception:
+                logger.exception("Failed to supervise the outbox worker")
+                self._step_down()
+            self.stop_event.wait(self.election_interval)
+
+    def _elect(self):
+        if self.lock.acquire():
+            self._start_jobs()
+            logger.info("Elected to run the outbox worker", extra={"pid": os.getpid()})
+
+    def _step_down(self):
+        self._stop_jobs()
+        self.lock.release()
+
+    def _job_factories(self):
+        # Factories rather than threads, a thread can only be started once
+        factories = [
+            lambda: Worker(self.app, self.galaxy, self.config.worker),
+            lambda: Retention(self.app, self.config.retention),
+        ]
+        if self.config.reconcile.interval > 0:
+            factories.append(lambda: Reconciler(self.app, self.galaxy, self.config.reconcile))
+        return factories
+
+    def _start_jobs(self):
+        self.galaxy = self.galaxy_factory(self.config)
+        self.factories = self._job_factories()
+        self.jobs = [factory() for factory in self.factories]
+        for job in self.jobs:
+            job.start()
+
+    def _restart_dead_jobs(self):
+        for i, job in enumerate(self.jobs):
+            if not job.is_alive():
+                logger.error("Restarting a stopped job", extra={"job": type(job).__name__})
+                self.jobs[i] = self.factories[i]()
+                self.jobs[i].start()
+
+    def _stop_jobs(self, timeout=None):
+        for job in self.jobs:
+            job.stop()
+        for job in self.jobs:
+            if job.is_alive():
+                job.join(timeout)
+        self.jobs = []
+        if self.galaxy is not None:
+            self.galaxy.close()
+            self.galaxy = None
+
+    def stop(self, timeout=None):
+        """Stop the jobs, waiting up to timeout for each to finish its current work."""
+        self.stop_event.set()  # Signal to stop
+        if self.is_alive():
+            self.join()
+        self._stop_jobs(timeout)
+        self.lock.release()
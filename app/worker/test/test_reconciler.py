@@ -0,0 +1,54 @@
+from internal.config import ReconcileConfig
+from worker.reconciler import Reconciler, merge_join, ABSENT
+from conftest import HEADERS, FakeGalaxy
+
+def preference(url):
+    return {"accp|pulsar_host": url, "accp|pulsar_api_key": "key", "other": "kept"}
+
+def test_merge_join():
+    rows = list(merge_join([("a", 1), ("c", 3), ("d", 4)], [("b", 2), ("c", 30)]))
+    assert rows == [("a", 1, ABSENT), ("b", ABSENT, 2), ("c", 3, 30), ("d", 4, ABSENT)]
+
+def test_reconcile_corrects_only_drifted_users(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar1", "api_key": "key", "users": ["a@test.com", "b@test.com", "c@test.com"]},
+        headers=HEADERS,
+    )
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar2", "api_key": "key", "users": ["a@test.com", "d@test.com"]},
+        headers=HEADERS,
+    )
+    # e@test.com no longer belongs to any pulsar
+    client.post("/api/pulsar", json={"url": "http://pulsar3", "api_key": "key", "users": ["e@test.com"]}, headers=HEADERS)
+    client.delete("/api/pulsar/3", headers=HEADERS)
+
+    galaxy = FakeGalaxy({
+        "a@test.com": preference("http://pulsar1"),  # Any of the user's pulsars is in sync
+        "b@test.com": preference("http://stale"),
+        "d@test.com": {"other": "kept"},
+        "e@test.com": preference("http://pulsar3"),
+        "f@test.com": preference("http://elsewhere"),  # Not managed by the registry
+    })
+    reconciler = Reconciler(app, galaxy, ReconcileConfig(chunk_size=2, batch_size=2, throttle=0))
+
+    report = reconciler.reconcile(dry_run=True)
+    assert (report.checked, report.drifted, report.corrected, report.unmanaged) == (5, 4, 0, 1)
+    assert galaxy.batches == []
+    # Both sides are read in pages
+    assert galaxy.pages == 3
+
+    report = reconciler.reconcile()
+    assert (report.drifted, report.corrected, report.missing, report.failed) == (4, 4, 0, 0)
+    # c@test.com has no Galaxy preference yet
+    assert galaxy.batches == [
+        [("b@test.com", "http://pulsar1"), ("c@test.com", "http://pulsar1")],
+        [("d@test.com", "http://pulsar2"), ("e@test.com", None)],
+    ]
+
+def test_reconcile_reports_missing_galaxy_users(app, client):
+    client.post("/api/pulsar", json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com"]}, headers=HEADERS)
+    galaxy = FakeGalaxy({}, missing=["a@test.com"])
+    report = Reconciler(app, galaxy, ReconcileConfig(throttle=0)).reconcile()
+    assert (report.drifted, report.corrected, report.missing) == (1, 0, 1)
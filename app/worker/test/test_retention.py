@@ -0,0 +1,33 @@
+import datetime
+from internal.config import RetentionConfig
+from models.model import Outbox
+from worker.retention import Retention
+from sqlalchemy import select, update
+from conftest import HEADERS
+
+def outbox_ids(app):
+    with app.state.db.get_session() as session:
+        return session.execute(select(Outbox.id).order_by(Outbox.id)).scalars().all()
+
+def test_purge_old_completed_rows(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": [f"user{i}@test.com" for i in range(5)]},
+        headers=HEADERS,
+    )
+    old = datetime.datetime.now() - datetime.timedelta(days=30)
+    with app.state.db.get_session() as session:
+        session.execute(update(Outbox).where(Outbox.id <= 3).values(deleted_at=old))
+        session.execute(update(Outbox).where(Outbox.id == 4).values(deleted_at=datetime.datetime.now()))
+        session.commit()
+
+    retention = Retention(app, RetentionConfig(ttl=86400, batch_size=2, vacuum_threshold=3))
+    report = retention.purge()
+
+    assert report.purged == 3
+    assert report.vacuumed
+    assert outbox_ids(app) == [4, 5]
+
+    report = retention.purge()
+    assert report.purged == 0
+    assert not report.vacuumed
@@ -0,0 +1,119 @@
+import pytest
+import time
+from main import create_app
+from fastapi.testclient import TestClient
+from internal.config import AppConfig, WorkerConfig
+from models.model import Outbox
+from worker.supervisor import Supervisor, leader_lock
+from sqlalchemy import select
+from conftest import HEADERS, FakeGalaxy
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def pending(app):
+    with app.state.db.get_session() as session:
+        result = session.execute(select(Outbox).where(Outbox.deleted_at == None))
+        return result.scalars().all()
+
+def test_one_supervisor_runs_the_jobs(config):
+    # Two processes sharing a database, each with its own app
+    first, second = create_app(config), create_app(config)
+    galaxies = []
+
+    def galaxy_factory(config):
+        galaxies.append(FakeGalaxy())
+        return galaxies[-1]
+
+    leader = Supervisor(first, galaxy_factory, config, election_interval=0.05)
+    follower = Supervisor(second, galaxy_factory, config, election_interval=0.05)
+    leader.start()
+    wait_for(lambda: leader.jobs)
+    follower.start()
+    time.sleep(0.2)
+    assert follower.jobs == []
+    assert len(galaxies) == 1
+
+    leader.stop()
+    assert galaxies[0].closed
+    wait_for(lambda: follower.jobs)
+    follower.stop()
+    assert len(galaxies) == 2
+
+def test_lock_follows_the_database_url(tmp_path):
+    config = AppConfig(test = True)
+    if config.database.url is not None:
+        pytest.skip("Postgres uses an advisory lock")
+    config.database.debug = False
+    # InMemory is still set, as in config.ini.sample
+    config.database.url = f"sqlite:///{tmp_path / 'registry.db'}"
+    app = create_app(config)
+
+    lock = leader_lock(app.state.db)
+    assert lock.acquire()
+    assert not leader_lock(create_app(config).state.db).acquire()
+    assert (tmp_path / "registry.db.worker.lock").exists()
+    lock.release()
+
+def test_dead_jobs_are_restarted(config):
+    app = create_app(config)
+    supervisor = Supervisor(app, lambda config: FakeGalaxy(), config, election_interval=0.05)
+    supervisor.start()
+    wait_for(lambda: supervisor.jobs)
+    worker = supervisor.jobs[0]
+    worker.stop()
+    worker.join()
+
+    wait_for(lambda: supervisor.jobs[0] is not worker and supervisor.jobs[0].is_alive())
+    supervisor.stop()
+
+def test_leader_steps_down_when_the_lock_is_lost(config):
+    first, second = create_app(config), create_app(config)
+    leader = Supervisor(first, lambda config: FakeGalaxy(), config, election_interval=0.05)
+    follower = Supervisor(second, lambda config: FakeGalaxy(), config, election_interval=0.05)
+    leader.start()
+    wait_for(lambda: leader.jobs)
+    follower.start()
+
+    # As when the lock's connection drops, freeing the lock for the follower
+    leader.lock.release()
+    leader.lock.held = lambda: False
+    leader.lock.acquire = lambda: False
+    wait_for(lambda: follower.jobs)
+    wait_for(lambda: not leader.jobs)
+    leader.stop()
+    follower.stop()
+
+def test_stop_drains_the_current_batch(config):
+    app = create_app(config)
+    client = TestClient(app)
+    galaxy = FakeGalaxy(latency=0.2)
+    supervisor = Supervisor(app, lambda config: galaxy, config, election_interval=0.05)
+    supervisor.start()
+    wait_for(lambda: supervisor.jobs)
+
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["user@test.com"]},
+        headers=HEADERS,
+    )
+    assert galaxy.called.wait(5)
+    supervisor.stop()
+
+    assert galaxy.batches == [[("user@test.com", "http://pulsar")]]
+    assert pending(app) == []
+
+@pytest.fixture
+def config(tmp_path):
+    config = AppConfig(test = True)
+    if config.database.url is None:
+        # The in-memory database can't be shared, use a file
+        config.database.in_memory = False
+        config.database.path = str(tmp_path / "registry.db")
+    config.database.debug = False
+    config.worker = WorkerConfig(debounce=0, concurrency=1)
+    config.reconcile.interval = 0
+    return config
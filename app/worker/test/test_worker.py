@@ -0,0 +1,279 @@
+import pytest
+import psycopg2
+import threading
+import time
+from internal.config import WorkerConfig
+from models.model import Outbox
+from worker.worker import Worker, EmptyOutboxException, CLAIM_LOCK_NAME
+from galaxy.galaxy import Galaxy
+from sqlalchemy import select, update, event, func
+import datetime
+from conftest import HEADERS, FakeGalaxy
+
+def pending(app):
+    with app.state.db.get_session() as session:
+        result = session.execute(select(Outbox).where(Outbox.deleted_at == None))
+        return result.scalars().all()
+
+def test_sweep_sends_batches(app, client):
+    for i in range(3):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://pulsar{i}", "api_key": "key", "users": [f"user{i}@test.com"]},
+            headers=HEADERS,
+        )
+    galaxy = FakeGalaxy()
+    worker = Worker(app, galaxy, WorkerConfig(batch_size=2, concurrency=1))
+    worker._drain()
+
+    assert [len(batch) for batch in galaxy.batches] == [2, 1]
+    assert pending(app) == []
+    with pytest.raises(EmptyOutboxException):
+        worker._sweep()
+
+@pytest.mark.parametrize("missing", [False, True])
+def test_sweep_query_count_does_not_grow_with_the_batch(app, client, missing):
+    users = [f"user{i}@test.com" for i in range(100)]
+    client.post("/api/pulsar", json={"url": "http://pulsar", "api_key": "key", "users": users}, headers=HEADERS)
+    statements = []
+    event.listen(app.state.db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    galaxy = FakeGalaxy(missing=users if missing else ())
+    Worker(app, galaxy, WorkerConfig(batch_size=100, concurrency=1))._sweep()
+
+    # Claim, load and mark, without refreshing the claimed rows one by one
+    assert len(statements) <= 6
+
+def test_worker_survives_a_failing_sweep(app, monkeypatch):
+    worker = Worker(app, FakeGalaxy(), WorkerConfig(debounce=0, poll_interval=0.01))
+    sweeps = []
+
+    def failing_sweep():
+        sweeps.append(1)
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(worker, "_sweep", failing_sweep)
+    worker.start()
+    time.sleep(0.1)
+    assert worker.is_alive()
+    assert len(sweeps) > 1
+    worker.stop()
+    worker.join()
+
+def test_sweep_keeps_missing_users_pending(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "b@test.com"]},
+        headers=HEADERS,
+    )
+    worker = Worker(app, FakeGalaxy(missing=["b@test.com"]))
+    worker._drain()
+
+    tasks = pending(app)
+    assert len(tasks) == 1
+    assert tasks[0].attempts == 1
+    assert tasks[0].last_error == "User b@test.com not found"
+    assert tasks[0].next_attempt_at > datetime.datetime.now()
+    assert tasks[0].claimed_by is None
+
+def test_failing_task_is_dead_lettered(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+    worker = Worker(app, FakeGalaxy(missing=["a@test.com"]), WorkerConfig(max_attempts=2))
+    for _ in range(2):
+        worker._drain()
+        with app.state.db.get_session() as session:
+            session.execute(update(Outbox).values(next_attempt_at=None))
+            session.commit()
+
+    tasks = pending(app)
+    assert tasks[0].attempts == 2
+    assert tasks[0].dead_at is not None
+    with pytest.raises(EmptyOutboxException):
+        worker._sweep()
+
+def test_failing_batch_is_bisected(app, client):
+    users = [f"user{i}@test.com" for i in range(8)]
+    client.post("/api/pulsar", json={"url": "http://pulsar", "api_key": "key", "users": users}, headers=HEADERS)
+
+    class PoisonedGalaxy(FakeGalaxy):
+        def sync_batch(self, changes):
+            if any(user.email == "user5@test.com" for user, _ in changes):
+                raise ValueError("invalid input syntax for type json")
+            return super().sync_batch(changes)
+
+    galaxy = PoisonedGalaxy()
+    Worker(app, galaxy, WorkerConfig(concurrency=1))._drain()
+
+    assert sorted(email for batch in galaxy.batches for email, _ in batch) == [
+        email for email in users if email != "user5@test.com"]
+    tasks = pending(app)
+    assert len(tasks) == 1
+    assert tasks[0].attempts == 1
+    assert tasks[0].last_error == "invalid input syntax for type json"
+
+def test_galaxy_outage_does_not_use_up_attempts(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+
+    class UnreachablePool:
+        def getconn(self):
+            raise psycopg2.OperationalError("connection refused")
+
+    # The real client, only its pool is stubbed
+    galaxy = Galaxy.__new__(Galaxy)
+    galaxy.pool = UnreachablePool()
+    galaxy.slots = threading.BoundedSemaphore(1)
+    worker = Worker(app, galaxy, WorkerConfig(max_attempts=1))
+    worker._drain()
+
+    tasks = pending(app)
+    assert tasks[0].attempts == 0
+    assert tasks[0].dead_at is None
+    assert tasks[0].last_error == "connection refused"
+    assert tasks[0].next_attempt_at > datetime.datetime.now()
+
+def test_sweep_coalesces_tasks_per_user(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+    for _ in range(9):
+        client.put(
+            "/api/pulsar/1",
+            json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "b@test.com"]},
+            headers=HEADERS,
+        )
+    galaxy = FakeGalaxy()
+    Worker(app, galaxy, WorkerConfig(concurrency=1))._drain()
+
+    assert len(galaxy.batches) == 1
+    assert sorted(email for email, _ in galaxy.batches[0]) == ["a@test.com", "b@test.com"]
+    assert pending(app) == []
+
+def test_newer_sync_supersedes_older_rows_in_backoff(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar1", "api_key": "key", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+    galaxy = FakeGalaxy(missing=["a@test.com"])
+    worker = Worker(app, galaxy, WorkerConfig(concurrency=1))
+    worker._drain()
+    assert pending(app)[0].next_attempt_at is not None
+
+    galaxy.missing = []
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar2", "api_key": "key", "users": ["a@test.com"]},
+        headers=HEADERS,
+    )
+    worker._drain()
+    assert galaxy.batches[-1] == [("a@test.com", "http://pulsar2")]
+    # The failed row is not retried once its backoff is over
+    assert pending(app) == []
+
+def test_sweep_syncs_the_task_pulsar(app, client):
+    for i in range(2):
+        client.post(
+            "/api/pulsar",
+            json={"url": f"http://pulsar{i}", "api_key": "key", "users": [f"user{i}@test.com"]},
+            headers=HEADERS,
+        )
+    client.delete("/api/pulsar/1", headers=HEADERS)
+    galaxy = FakeGalaxy()
+    Worker(app, galaxy, WorkerConfig(concurrency=1))._drain()
+
+    assert galaxy.batches == [[("user1@test.com", "http://pulsar1"), ("user0@test.com", None)]]
+
+def test_sweep_clears_users_removed_from_pulsar(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "b@test.com"]},
+        headers=HEADERS,
+    )
+    client.put(
+        "/api/pulsar/1",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "a@test.com"]},
+        headers=HEADERS,
+    )
+    galaxy = FakeGalaxy()
+    Worker(app, galaxy, WorkerConfig(concurrency=1))._drain()
+
+    assert galaxy.batches == [[("a@test.com", "http://pulsar"), ("b@test.com", None)]]
+
+def test_sweep_shards_users_across_connections(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": [f"user{i}@test.com" for i in range(4)]},
+        headers=HEADERS,
+    )
+    galaxy = FakeGalaxy()
+    Worker(app, galaxy, WorkerConfig(concurrency=2))._drain()
+
+    assert sorted(len(batch) for batch in galaxy.batches) == [2, 2]
+    assert pending(app) == []
+
+def test_claims_are_exclusive_until_lease_expires(app, client):
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "b@test.com"]},
+        headers=HEADERS,
+    )
+    first = Worker(app, FakeGalaxy())
+    second = Worker(app, FakeGalaxy())
+    with app.state.db.get_session() as session:
+        claimed = first._claim_tasks(session)
+        assert len(claimed) == 2
+        assert second._claim_tasks(session) == []
+
+        session.execute(update(Outbox).values(lease_expires_at=datetime.datetime.now()))
+        session.commit()
+        reclaimed = second._claim_tasks(session)
+        assert len(reclaimed) == 2
+        assert all(task.claimed_by == second.worker_id for task in reclaimed)
+        assert all(task.attempts == 2 for task in reclaimed)
+
+def test_claims_skip_users_locked_by_a_concurrent_claim(app, client):
+    if app.state.db.engine.dialect.name != "postgresql":
+        pytest.skip("SQLite serializes claims with its write lock")
+    client.post(
+        "/api/pulsar",
+        json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com", "b@test.com"]},
+        headers=HEADERS,
+    )
+    with app.state.db.get_session() as concurrent, app.state.db.get_session() as session:
+        # A claim of a@test.com that hasn't committed its lease yet
+        user_id = concurrent.execute(select(Outbox.user_id).order_by(Outbox.id)).scalars().first()
+        assert concurrent.execute(select(func.pg_try_advisory_xact_lock(func.hashtext(CLAIM_LOCK_NAME), user_id))).scalar()
+
+        claimed = Worker(app, FakeGalaxy())._claim_tasks(session)
+        assert len(claimed) == 1
+        assert claimed[0].user_id != user_id
+        concurrent.rollback()
+
+def test_worker_wakes_up_on_signal(app, client):
+    galaxy = FakeGalaxy()
+    worker = Worker(app, galaxy, WorkerConfig(debounce=0, poll_interval=60))
+    worker.start()
+    try:
+        client.post(
+            "/api/pulsar",
+            json={"url": "http://pulsar", "api_key": "key", "users": ["a@test.com"]},
+            headers=HEADERS,
+        )
+        for _ in range(100):
+            if galaxy.batches:
+                break
+            time.sleep(0.01)
+        assert galaxy.batches == [[("a@test.com", "http://pulsar")]]
+    finally:
+        worker.stop()
+        worker.join(timeout=1)
+    assert not worker.is_alive()
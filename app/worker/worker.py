@@ -1,58 +1,276 @@
 import threading
-from sqlalchemy import select
-import time
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update, and_, or_, bindparam, func
 import datetime
-from models.model import Outbox, Pulsar, User
+import random
+from models.model import Outbox, Pulsar, User, pulsar_user
+from internal.config import WorkerConfig
+from internal.metrics import WORKER_SWEEP_DURATION
+from galaxy.galaxy import GalaxyUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock class of the users being claimed, on Postgres
+CLAIM_LOCK_NAME = "pulsar_registry_outbox_user"
 
 class EmptyOutboxException(Exception):
     pass
 
 class Worker(threading.Thread):
-    def __init__(self, app, galaxy):
+    def __init__(self, app, galaxy, config=None):
         super().__init__(daemon=True)  # Daemon thread will exit when the main thread does
+        config = config or WorkerConfig()
         self.app = app
         self.galaxy = galaxy
         self.stop_event = threading.Event()  # Event to signal when to stop
-        self.sleep_time = 1  # Time to sleep between tasks
+        self.wakeup_event = app.state.outbox_event  # Set by the controllers on new outbox rows
+        self.batch_size = config.batch_size  # Tasks fetched and sent to Galaxy per sweep
+        self.debounce = config.debounce  # Time to gather more writes once woken up
+        self.poll_interval = config.poll_interval  # Fallback for rows written by other processes
+        self.concurrency = config.concurrency  # Galaxy batches sent in parallel
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="galaxy")
+        self.lease_duration = datetime.timedelta(seconds=config.lease_duration)  # Time before claimed tasks can be reclaimed
+        self.max_attempts = config.max_attempts  # Attempts before a task is dead-lettered
+        self.retry_base_delay = config.retry_base_delay
+        self.retry_max_delay = config.retry_max_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
     def run(self):
         while not self.stop_event.is_set():  # Keep running until stop_event is set
-            time.sleep(60)  # Sleep for a bit
+            self.wakeup_event.wait(self.poll_interval)
+            if self.stop_event.wait(self.debounce):
+                break
+            self.wakeup_event.clear()
             try:
-                with self.app.state.db.get_session() as session:
-                    tasks = self._get_tasks(session)
-                    for task in tasks:
-                        try:
-                            self._process_task(session, task)
-                            self._mark_task_complete(task)
-                        except Exception as e:
-                            print(f"Failed to process task: {task}: {e}")
-                    session.commit()
-            except EmptyOutboxException:
-                continue  # No task available, loop again
+                self._drain()
+            except Exception:
+                # Leased tasks are reclaimed once their lease expires
+                logger.exception("Failed to sync outbox")
+        self.executor.shutdown(wait=True)
+
+    def _drain(self):
+        try:
+            while self._sweep() and not self.stop_event.is_set():
+                pass
+        except EmptyOutboxException:
+            pass  # No task available, wait for the next signal
+
+    def _sweep(self):
+        # Returns True when more tasks may be pending
+        # Claimed tasks stay loaded across commits, refreshing them would cost a query per row
+        with WORKER_SWEEP_DURATION.time(), self.app.state.db.get_session(write=True, expire_on_commit=False) as session:
+            tasks = self._get_tasks(session)
+            compacted = self._compact_tasks(session, tasks)
+            session.commit()
+            completed = self._process_batch(session, compacted)
+            session.commit()
+            return len(tasks) == self.batch_size and len(tasks) - len(compacted) + completed > 0
 
     def _get_tasks(self, session):
-        # Implement your task retrieval logic here
-        result = session.execute(select(Outbox).where(Outbox.deleted_at == None).order_by(Outbox.id))
-        tasks = result.scalars().all()
+        tasks = self._claim_tasks(session)
         if len(tasks) == 0:
             raise EmptyOutboxException("No tasks available")
         return tasks
 
+    def _claim_tasks(self, session):
+        """
+        Atomically lease up to batch_size pending tasks to this worker.
+
+        Tasks whose lease expired are reclaimed, tasks waiting for a retry or
+        dead-lettered are left alone, and users with tasks leased
+        by another worker are skipped so a user is only synced by one worker
+        at a time. On Postgres, leases of a concurrent claim are not visible
+        until it commits, so each claimed user is also locked for the
+        transaction and users locked by another claim are skipped. On SQLite,
+        claims are serialized by the write lock taken by the sweep.
+        """
+        now = datetime.datetime.now()
+        expires_at = now + self.lease_duration
+        available = and_(
+            Outbox.dead_at == None,
+            or_(Outbox.lease_expires_at == None, Outbox.lease_expires_at < now),
+            or_(Outbox.next_attempt_at == None, Outbox.next_attempt_at <= now),
+        )
+        busy_users = (
+            select(Outbox.user_id)
+            .where(Outbox.deleted_at == None)
+            .where(Outbox.claimed_by != self.worker_id)
+            .where(Outbox.lease_expires_at >= now)
+        )
+        candidates = (
+            select(Outbox.id)
+            .where(Outbox.deleted_at == None)
+            .where(available)
+            .where(Outbox.user_id.not_in(busy_users))
+            .order_by(Outbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        if session.get_bind().dialect.name == "postgresql":
+            candidates = candidates.where(
+                func.pg_try_advisory_xact_lock(func.hashtext(CLAIM_LOCK_NAME), Outbox.user_id))
+        # Select first, a locking subquery inside the UPDATE may be rescanned by Postgres
+        candidate_ids = session.execute(candidates).scalars().all()
+        if not candidate_ids:
+            session.commit()
+            return []
+        session.execute(
+            update(Outbox)
+            .where(Outbox.id.in_(candidate_ids))
+            .where(Outbox.deleted_at == None)
+            .where(available)
+            .values(
+                claimed_by=self.worker_id,
+                lease_expires_at=expires_at,
+                attempts=Outbox.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        result = session.execute(
+            select(Outbox)
+            .where(Outbox.deleted_at == None)
+            .where(Outbox.claimed_by == self.worker_id)
+            .where(Outbox.lease_expires_at == expires_at)
+            .order_by(Outbox.id)
+        )
+        return result.scalars().all()
+
+    def _compact_tasks(self, session, tasks):
+        # Only the latest pending row per user matters, the others are superseded
+        latest = {}
+        for task in tasks:
+            latest[task.user_id] = task
+        superseded = [task.id for task in tasks if latest[task.user_id] is not task]
+        if superseded:
+            logger.debug("Compacting superseded tasks", extra={"tasks": len(superseded)})
+            session.execute(
+                update(Outbox)
+                .where(Outbox.id.in_(superseded))
+                .values(deleted_at=datetime.datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+        return sorted(latest.values(), key=lambda task: task.id)
+
+    def _process_batch(self, session, tasks):
+        # Tasks are compacted to one per user, so sharding by user keeps per-user order
+        shards = {}
+        changes = self._load_changes(session, tasks)
+        session.commit()  # Don't hold the SQLite write lock while Galaxy is called
+        for task, change in changes:
+            shards.setdefault(task.user_id % self.concurrency, []).append((task, change))
+        # Tasks whose user no longer exists have nothing left to sync
+        synced = {task.id for task, _ in changes}
+        done_tasks = [task for task in tasks if task.id not in synced]
+        for done, failed in self.executor.map(self._sync_shard, shards.values()):
+            done_tasks.extend(done)
+            for task, error, counted in failed:
+                self._mark_task_failed(task, error, counted)
+        self._mark_tasks_complete(session, done_tasks)
+        return len(done_tasks)
+
+    def _load_changes(self, session, tasks):
+        """
+        Resolve the desired Galaxy state of each task's user in one query.
+
+        The task's pulsar is used while the user still belongs to it,
+        otherwise the user's most recent remaining pulsar, otherwise the
+        user's preference is removed.
+        """
+        by_id = {task.id: task for task in tasks}
+        result = session.execute(
+            select(Outbox.id, User, Pulsar)
+            .join(User, User.id == Outbox.user_id)
+            .outerjoin(pulsar_user, pulsar_user.c.user_id == User.id)
+            .outerjoin(Pulsar, Pulsar.id == pulsar_user.c.pulsar_id)
+            .where(Outbox.id.in_(by_id.keys()))
+        )
+        users = {}
+        candidates = {}
+        for task_id, user, pulsar in result:
+            users[task_id] = user
+            if pulsar is not None:
+                candidates.setdefault(task_id, []).append(pulsar)
+        changes = []
+        for task_id, user in users.items():
+            task = by_id[task_id]
+            pulsars = candidates.get(task_id, [])
+            pulsar = next((pulsar for pulsar in pulsars if pulsar.id == task.pulsar_id), None)
+            if pulsar is None and pulsars:
+                pulsar = max(pulsars, key=lambda pulsar: pulsar.id)
+            changes.append((task, (user, pulsar)))
+        return sorted(changes, key=lambda change: change[0].id)
+
+    def _sync_shard(self, shard):
+        # Runs on the executor, must not touch the session
+        try:
+            missing = set(self.galaxy.sync_batch([change for _, change in shard]))
+        except GalaxyUnavailableError as e:
+            # An outage is not the tasks' fault, retry them without using up their attempts
+            logger.warning("Galaxy is unavailable", extra={"tasks": len(shard), "error": str(e)})
+            return [], [(task, str(e), False) for task, _ in shard]
+        except Exception as e:
+            if len(shard) > 1:
+                # Bisect, so one bad change does not fail the others of the batch
+                middle = len(shard) // 2
+                done, failed = self._sync_shard(shard[:middle])
+                more_done, more_failed = self._sync_shard(shard[middle:])
+                return done + more_done, failed + more_failed
+            logger.warning("Failed to process task", extra={"task": shard[0][0].id, "error": str(e)})
+            return [], [(shard[0][0], str(e), True)]
+        done = []
+        failed = []
+        for task, (user, _) in shard:
+            if user.email in missing:
+                logger.warning("Failed to process task, user not found", extra={"task": task.id, "email": user.email})
+                failed.append((task, f"User {user.email} not found", True))
+                continue
+            done.append(task)
+        return done, failed
 
-    def _process_task(self, session, task):
-        print(f"Processing task: {task}")
-        result = session.execute(select(Pulsar).filter().order_by(Pulsar.id).limit(1))
-        pulsar = result.scalar_one_or_none()
-        user = session.query(User).filter(User.id == task.user_id).one()
-        if pulsar is None:
-            self.galaxy.remove_pulsar(user)
-        else:
-            self.galaxy.update_pulsar(user, pulsar)
+    def _mark_tasks_complete(self, session, tasks):
+        # Soft delete the tasks from the database
+        if not tasks:
+            return
+        now = datetime.datetime.now()
+        session.execute(
+            update(Outbox)
+            .where(Outbox.id.in_([task.id for task in tasks]))
+            .values(deleted_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        # Older rows of the same users waiting for a retry are superseded,
+        # retrying them later would overwrite Galaxy with an older state
+        outbox = Outbox.__table__
+        session.execute(
+            update(outbox)
+            .where(outbox.c.user_id == bindparam("task_user_id"))
+            .where(outbox.c.id < bindparam("task_id"))
+            .where(outbox.c.deleted_at == None)
+            .where(outbox.c.dead_at == None)
+            .values(deleted_at=now),
+            [{"task_user_id": task.user_id, "task_id": task.id} for task in tasks],
+        )
 
-    def _mark_task_complete(self, task):
-        # Soft delete the task from the database
-        task.deleted_at = datetime.datetime.now()
+    def _mark_task_failed(self, task, error, counted=True):
+        # Release the lease and retry later with exponential backoff and jitter
+        now = datetime.datetime.now()
+        task.last_error = error
+        task.claimed_by = None
+        task.lease_expires_at = None
+        if not counted:
+            task.attempts -= 1  # Given back, the claim counted it
+        if task.attempts >= self.max_attempts:
+            logger.error("Dead-lettering task", extra={"task": task.id, "attempts": task.attempts, "error": error})
+            task.dead_at = now
+            return
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** max(task.attempts - 1, 0))
+        task.next_attempt_at = now + datetime.timedelta(seconds=random.uniform(delay / 2, delay))
 
     def stop(self):
         self.stop_event.set()  # Signal to stop
+        self.wakeup_event.set()  # Interrupt the wait